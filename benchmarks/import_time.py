@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+import time benchmark of the command line entry point
+
+    python benchmarks/import_time.py [--runs N] [--top N]
+
+imports `blogme.cli` in fresh interpreters with `-X importtime`, reports
+the best total and the slowest top level imports, and fails if one of
+the heavy dependencies is imported before it is needed.
+"""
+
+import os
+import sys
+import subprocess
+from typing import Dict, Tuple
+
+#: dependencies the cli must not import before an action runs
+lazy_modules = ('jinja2', 'werkzeug', 'yaml', 'markdown', 'docutils',
+                'pygments', 'babel')
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure(statement: str) -> Tuple[int, Dict[str, int]]:
+    """Returns the total and the cumulative time per module in us"""
+    env = dict(os.environ, PYTHONPATH=root)
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c',
+                           statement], env=env, stderr=subprocess.PIPE,
+                          universal_newlines=True, check=True)
+    modules = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if cumulative.strip().isdigit():
+            # one space before top level modules, two more per level
+            modules[name.rstrip()[1:]] = int(cumulative)
+    total = sum(v for k, v in modules.items() if not k.startswith(' '))
+    return total, modules
+
+
+def main():
+    args = sys.argv[1:]
+    runs = int(args[args.index('--runs') + 1]) if '--runs' in args else 5
+    top = int(args[args.index('--top') + 1]) if '--top' in args else 10
+
+    best = None
+    for _ in range(runs):
+        total, modules = measure('import blogme.cli')
+        if best is None or total < best[0]:
+            best = total, modules
+    total, modules = best
+
+    print(f'import blogme.cli: {total / 1000:.1f} ms (best of {runs})')
+    roots = sorted(((v, k) for k, v in modules.items()
+                    if not k.startswith(' ')), reverse=True)
+    for usec, name in roots[:top]:
+        print(f'  {usec / 1000:8.1f} ms  {name}')
+
+    loaded = {x.strip().split('.')[0] for x in modules}
+    eager = sorted(loaded.intersection(lazy_modules))
+    if eager:
+        print('imported eagerly:', ', '.join(eager))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+content fingerprinted copies of static files, so they can be cached forever
+"""
+
+import os
+import hashlib
+from typing import TYPE_CHECKING, Optional
+
+from blogme.output import file_digest
+
+
+if TYPE_CHECKING:
+    from blogme.builder import Builder
+
+
+def fingerprinted_filename(filename: str, digest: str) -> str:
+    base, ext = os.path.splitext(filename)
+    return f'{base}.{digest[:10]}{ext}'
+
+
+class Assets:
+    """
+    public attr
+        - enabled
+        - manifest              // {static filename: fingerprinted filename}
+        - changed               // manifest differs from the last build
+
+    public method
+        - begin                 // start collecting assets for a build
+        - add                   // register a static file by source or data
+        - write                 // write the fingerprinted copies
+    """
+
+    def __init__(self, builder: 'Builder', enabled: bool = False):
+        self.builder = builder
+        self.enabled = enabled
+        self.manifest = {}
+        self._sources = {}
+        # {source filename: [size, mtime_ns, digest]}
+        self._digests = {}
+
+    @property
+    def changed(self) -> bool:
+        return self.builder.get_cache('assets').get('manifest', {}) != \
+            self.manifest
+
+    def begin(self) -> None:
+        self.manifest = {}
+        self._sources = {}
+        if not self.enabled:
+            return
+        self._digests = self.builder.get_cache('assets').setdefault(
+            'digests', {})
+        folder = os.path.join(self.builder.project_folder,
+                              self.builder.config.root_get('static_folder') or
+                              self.builder.default_static_folder)
+        for dirpath, dirnames, filenames in os.walk(folder):
+            for filename in filenames:
+                source = os.path.join(dirpath, filename)
+                rel = os.path.relpath(source, folder).replace(os.sep, '/')
+                self.add(rel, source=source)
+
+    def _source_digest(self, source: str) -> str:
+        st = os.stat(source)
+        cached = self._digests.get(source)
+        if cached and cached[:2] == [st.st_size, st.st_mtime_ns]:
+            return cached[2]
+        digest = file_digest(source)
+        self._digests[source] = [st.st_size, st.st_mtime_ns, digest]
+        return digest
+
+    def add(self, filename: str, source: Optional[str] = None,
+            data: Optional[bytes] = None) -> None:
+        """
+        Registers a file of the static folder, either copied from source
+        or generated from data.
+        """
+        if not self.enabled:
+            return
+        if source is not None:
+            digest = self._source_digest(source)
+        else:
+            if isinstance(data, str):
+                data = data.encode('utf-8')
+            digest = hashlib.sha1(data).hexdigest()
+        self.manifest[filename] = fingerprinted_filename(filename, digest)
+        self._sources[filename] = (source, data)
+
+    def write(self) -> None:
+        cache = self.builder.get_cache('assets')
+        if not self.enabled:
+            # pages built while it was enabled link to fingerprints
+            cache['manifest'] = {}
+            return
+        writer = self.builder.writer
+        for filename, (source, data) in self._sources.items():
+            target = os.path.join(self.builder.static_folder,
+                                  self.manifest[filename])
+            if source is not None:
+                writer.copy(source, target)
+            else:
+                writer.write(target, data)
+        cache['manifest'] = dict(self.manifest)
+        live = {source for source, data in self._sources.values()}
+        for source in list(self._digests):
+            if source not in live:
+                del self._digests[source]
@@ -1,12 +1,14 @@
 # -*- coding: utf-8 -*-
 
 import os
+import json
+import hashlib
+import shutil
 from fnmatch import fnmatch
 from urllib.parse import urlparse
 import datetime
 
 from jinja2 import Environment, FileSystemLoader
-from babel import Locale, dates
 from werkzeug.routing import Map, Rule
 from werkzeug.urls import url_unquote
 
@@ -17,8 +19,17 @@ from blogme.signals import (
     before_build
 )
 from blogme.modules import find_module
-from blogme.file_parser import RSTParser, CopyParser, MDParser, BaseParser
+from blogme.file_parser import (
+    RSTParser, CopyParser, MDParser, BaseParser, TemplateParser
+)
 from blogme.config import Config
+from blogme.output import output_backends, MemoryOutputWriter, atomic_write
+from blogme.compress import Compressor
+from blogme.minify import Minifier
+from blogme.assets import Assets
+from blogme.formatting import DateFormatter
+from blogme.routing import RouteCache
+from blogme.jobs import ListingJobs
 
 
 builtin_file_parsers = {
@@ -27,6 +38,7 @@ builtin_file_parsers = {
     'copy': CopyParser
 }
 default_output_folder = '_build'
+default_cache_folder = '.blogme-cache'
 builtin_templates = os.path.join(os.path.dirname(__file__), 'templates')
 builtin_static = os.path.join(os.path.dirname(__file__), 'static')
 
@@ -52,6 +64,7 @@ class FileContext:
         - destination_filename
         - full_destination_filename
         - is_new
+        - is_template
         - needs_build
         - public
 
@@ -60,7 +73,9 @@ class FileContext:
         - open_source_file             // for reading source file
         - make_destination_folder      // for witing/copy dest file
         - open_destination_file        // for writing dest file
-        - run                          // build
+        - prepare                      // parse meta, publish the file
+        - invalidate                   // build even if the source is unchanged
+        - run                          // build, or keep the last output
     """
     default_file_parsers = {
         '*.rst': 'rst',
@@ -77,6 +92,8 @@ class FileContext:
         self.source_filename = source_filename
         # processed html link tags
         self._link_tags = []
+        # something the page shows changed, see `invalidate`
+        self._invalid = False
         # find the right text parser
 
         self._file_parser = self._guess_file_parser(source_filename)
@@ -84,10 +101,13 @@ class FileContext:
         self.destination_filename = self._file_parser.get_desired_filename()
         # parse meta info
         if prepare:
-            self._file_parser.prepare()
-            after_file_prepared.send(self)
-            if self.public:
-                after_file_published.send(self)
+            self.prepare()
+
+    def prepare(self):
+        self._file_parser.prepare()
+        after_file_prepared.send(self)
+        if self.public:
+            after_file_published.send(self)
 
     def _guess_file_parser(self, filename: str) -> BaseParser:
         file_parser_name = self.config.get('file_parser')
@@ -105,7 +125,12 @@ class FileContext:
 
     @property
     def is_new(self):
-        return not os.path.exists(self.full_destination_filename)
+        return not self.builder.writer.exists(self.full_destination_filename)
+
+    @property
+    def is_template(self):
+        """rendered into a template, not copied as it is"""
+        return isinstance(self._file_parser, TemplateParser)
 
     @property
     def public(self):
@@ -130,11 +155,23 @@ class FileContext:
     def full_source_filename(self):
         return os.path.join(self.builder.project_folder, self.source_filename)
 
+    def invalidate(self):
+        """
+        For modules whose data shows up on the page: build it this time
+        even if its source did not change.
+        """
+        self._invalid = True
+
     @property
     def needs_build(self):
-        if self.is_new:
+        if self.is_new or self._invalid:
             return True
         src = self.full_source_filename
+        # unchanged outputs are not rewritten, so compare against the
+        # source mtime of the last build rather than the output mtime
+        built = self.builder.get_cache('sources').get(self.source_filename)
+        if built is not None:
+            return os.path.getmtime(src) != built
         dst = self.full_destination_filename
         return os.path.getmtime(dst) < os.path.getmtime(src)
 
@@ -147,8 +184,7 @@ class FileContext:
         return open(self.full_source_filename, mode)
 
     def open_destination_file(self, mode='w'):
-        self.make_destination_folder()
-        return open(self.full_destination_filename, mode)
+        return self.builder.writer.open(self.full_destination_filename, mode)
 
     def _get_default_template_context(self):
         return {
@@ -177,14 +213,19 @@ class FileContext:
             'rel':      'stylesheet'
         })
 
-    def run(self, force_build: bool = False):
+    def run(self, force_build: bool = False, build: bool = True):
         before_file_processed.send(self)
-        if force_build or self.needs_build:
+        if build and (force_build or self.needs_build):
             self._build()
+        else:
+            self.builder.writer.keep(self.full_destination_filename)
+            self._file_parser.update_summary()
 
     def _build(self):
         before_file_built.send(self)
         self._file_parser.run()
+        self.builder.get_cache('sources')[self.source_filename] = \
+            os.path.getmtime(self.full_source_filename)
 
 
 class BuildError(ValueError):
@@ -197,20 +238,34 @@ class RouteAndTemplateMixin:
         - prefix_path
     public method
         - register_url
+        - has_url
+        - register_producer            // render one url on its own
+        - get_producer
         - link_to
+        - get_link_filename            // the output filename of a link
         - open_link_file
+        - render_link_file             // render unless the inputs are unchanged
+        - submit_link_file             // the same, in the listing worker pool
         - update_jinja_env
         - render_template
+        - format_date
+        - format_datetime
+        - format_time
     """
     default_template_path = '_templates'
 
     def __init__(self):
-        self._locale = Locale(self.config.root_get('locale') or 'zh')
+        # babel is loaded on the first formatted date
+        self._dates = DateFormatter(self.config.root_get('locale') or 'zh')
         self._url_map = Map()
+        self._url_keys = set()
         parsed = urlparse(self.config.root_get('canonical_url'))
         self.prefix_path = parsed.path
         self._url_adapter = self._url_map.bind(
             'dummy.invalid', script_name=self.prefix_path)
+        self._routes = RouteCache(self._url_map, self._url_adapter)
+        self._link_filenames = {}
+        self._producers = {}
         self.register_url('home', '/')
         self.register_url('post', '/<path:slug>')
 
@@ -218,17 +273,18 @@ class RouteAndTemplateMixin:
             self.project_folder,
             self.config.root_get('template_path') or self.default_template_path
         )
+        self._template_paths = [template_path, builtin_templates]
 
         self._jinja_env = Environment(
-            loader=FileSystemLoader([template_path, builtin_templates]),
+            loader=FileSystemLoader(self._template_paths),
             autoescape=self.config.root_get('template_autoescape', True),
             extensions=['jinja2.ext.autoescape', 'jinja2.ext.with_'],
         )
         self._jinja_env.globals.update(
             link_to=self.link_to,
-            format_datetime=self._format_datetime,
-            format_date=self._format_date,
-            format_time=self._format_time,
+            format_datetime=self._dates.format_datetime,
+            format_date=self._dates.format_date,
+            format_time=self._dates.format_time,
             config=self.config
         )
 
@@ -248,34 +304,136 @@ class RouteAndTemplateMixin:
                      config_default=None, **extra):
         if config_key is not None:
             rule = self.config.root_get(config_key, config_default)
-        self._url_map.add(Rule(rule, endpoint=key, **extra))
+        rule = Rule(rule, endpoint=key, **extra)
+        self._url_map.add(rule)
+        self._routes.add(rule)
+        self._link_filenames.clear()
+        self._url_keys.add(key)
+
+    def register_producer(self, key, func):
+        """
+        Registers `func(builder, **values)` as the producer of the urls of
+        `key`: it writes the single output of `link_to(key, **values)` and
+        returns False if there is none.  The lazy dev server renders
+        listing pages through their producers.
+        """
+        self._producers[key] = func
+
+    def get_producer(self, key):
+        return self._producers.get(key)
+
+    def has_url(self, key):
+        return key in self._url_keys
 
     def link_to(self, _key, **values):
-        return self._url_adapter.build(_key, values)
-
-    def _get_link_filename(self, _key, **values):
-        link = url_unquote(self.link_to(_key, **values)[len(self.prefix_path):])
+        if _key == 'static':
+            filename = self.assets.manifest.get(values.get('filename'))
+            if filename is not None:
+                values = dict(values, filename=filename)
+        return self._routes.build(_key, values)
+
+    def get_link_filename(self, _key, **values):
+        key = (_key, tuple(sorted(values.items())))
+        rv = self._link_filenames.get(key)
+        if rv is not None:
+            return rv
+        link = self._routes.build(_key, values)
+        link = url_unquote(link[len(self.prefix_path):])
         link = link.lstrip('/')
         if not link or link.endswith('/'):
             link += 'index.html'
-        return os.path.join(self.dest_folder, link)
+        rv = self._link_filenames[key] = os.path.join(self.dest_folder, link)
+        return rv
 
     def open_link_file(self, _key, mode='w', **values):
-        filename = self._get_link_filename(_key, **values)
-        folder = os.path.dirname(filename)
-        os.makedirs(folder, exist_ok=True)
-        return open(filename, mode)
-
-    def _format_datetime(self, datetime=None, format='medium'):
-        return dates.format_datetime(datetime, format, locale=self._locale)
-
-    def _format_time(self, time=None, format='medium'):
-        return dates.format_time(time, format, locale=self._locale)
-
-    def _format_date(self, date=None, format='medium', locale=None):
-
-        return dates.format_date(
-            date, format, locale=Locale(locale) if locale else self._locale)
+        filename = self.get_link_filename(_key, **values)
+        return self.writer.open(filename, mode)
+
+    def _get_layout_signature(self):
+        """
+        what every rendered page depends on: the root config, the template
+        files, the year in the footer and whatever modules put into the
+        `layout` storage
+        """
+        storage = self.get_storage('layout')
+        if 'signature' not in storage:
+            templates = []
+            for folder in self._template_paths:
+                for dirpath, dirnames, filenames in os.walk(folder):
+                    for filename in filenames:
+                        full = os.path.join(dirpath, filename)
+                        templates.append([full, os.stat(full).st_mtime_ns])
+            data = [self.config.stack[0], templates,
+                    self.format_date(format='YYYY'),
+                    sorted((k, v) for k, v in storage.items())]
+            storage['signature'] = hashlib.sha1(json.dumps(
+                data, sort_keys=True, default=str).encode('utf-8')
+            ).hexdigest()
+        return storage['signature']
+
+    def _render_link_file(self, template_name, context, _key, signature,
+                          values):
+        # returns what `_write_link_file` needs, None for a kept page
+        filename = self.get_link_filename(_key, **values)
+        if signature is None:
+            digest = None
+        else:
+            key = os.path.relpath(filename, self.dest_folder)
+            digest = hashlib.sha1(json.dumps(
+                [self._get_layout_signature(), template_name, signature],
+                sort_keys=True, default=str).encode('utf-8')).hexdigest()
+            if (not self.force_build
+                    and self.get_cache('pages').get(key) == digest
+                    and self.writer.keep(filename)):
+                return None
+        rv = self.render_template(template_name, context)
+        entry = None if digest is None else (key, digest)
+        return filename, rv + '\n', entry
+
+    def _write_link_file(self, rendered):
+        if rendered is None:
+            return
+        filename, text, entry = rendered
+        with self.writer.open(filename) as f:
+            f.write(text)
+        if entry is not None:
+            self.get_cache('pages')[entry[0]] = entry[1]
+
+    def render_link_file(self, template_name, context, _key, signature=None,
+                         **values):
+        """
+        Renders template_name into the file of the given link.  If a json
+        serializable signature of everything the page shows is given, the
+        page is only rendered if it differs from the last build.
+        """
+        self._write_link_file(self._render_link_file(
+            template_name, context, _key, signature, values))
+
+    def submit_link_file(self, template_name, context, _key, signature=None,
+                         **values):
+        """
+        Like `render_link_file`, but from a `before_build_finished`
+        receiver the page is queued and rendered in the worker pool of
+        the listing pages (`listing_workers` in the root config) once
+        every receiver returned.  Elsewhere it is rendered right away.
+        """
+        jobs = self._listing_jobs
+        if jobs is None:
+            self.render_link_file(template_name, context, _key, signature,
+                                  **values)
+            return
+        jobs.submit(self.get_link_filename(_key, **values),
+                    self._render_link_file, template_name, context, _key,
+                    signature, values)
+
+    def format_datetime(self, datetime=None, format='medium', locale=None):
+        return self._dates.format_datetime(datetime, format, locale)
+
+    def format_time(self, time=None, format='medium', locale=None):
+        return self._dates.format_time(time, format, locale)
+
+    def format_date(self, date=None, format='medium', locale=None):
+        return self._dates.format_date(date, format, locale)
 
 
 class Builder(RouteAndTemplateMixin):
@@ -285,10 +443,21 @@ class Builder(RouteAndTemplateMixin):
         - config
         - dest_folder (full)
         - static_folder (full)
+        - cache_folder (full)
+        - writer                      // write-if-changed output writer
+        - assets                      // fingerprinted static files
+        - force_build                 // the running build ignores caches
+        - memory_report               // samples memory at phase boundaries
     public method:
         - get_storage                 // for module share data
+        - get_cache                   // for module data kept between builds
+        - get_memo                    // for data kept while the builder lives
         - anything_needs_build
         - run                         // build
+        - prune                       // delete stale outputs
+        - clean                       // delete output and cache folder
+        - set_output                  // switch the output backend
+        - flush                       // write in-memory outputs to disk
         - debug_serve                 // run a dev server
     """
     default_ignores = ('.*', '_*', 'config.yml', 'Makefile', 'README.*', '*.conf', )
@@ -300,6 +469,14 @@ class Builder(RouteAndTemplateMixin):
         RouteAndTemplateMixin.__init__(self)
         static = self.config.root_get('static_folder') or self.default_static_folder
         self.register_url('static', f'/{static}/<path:filename>')
+        self._caches = {}
+        self._memos = {}
+        self.force_build = False
+        self.memory_report = None
+        self._listing_jobs = None
+        self.writer = self._make_writer()
+        self.assets = Assets(
+            self, self.config.root_get('fingerprint_static', False))
         # setup module
         self._modules = []
         self._storage = {}
@@ -327,9 +504,64 @@ class Builder(RouteAndTemplateMixin):
             self.config.root_get('static_folder') or self.default_static_folder
         )
 
+    @property
+    def cache_folder(self):
+        return os.path.join(
+            self.project_folder,
+            self.config.root_get('cache_folder') or default_cache_folder
+        )
+
+    def _make_writer(self, backend: str = None, target: str = None):
+        backend = (backend or self.config.root_get('output_backend')
+                   or 'filesystem')
+        if backend not in output_backends:
+            raise BuildError(f'unknown output backend "{backend}"')
+        cls = output_backends[backend]
+        if target is None:
+            target = self.config.root_get('output_target')
+        writer = cls(self) if target is None else cls(self, target)
+        if self.config.root_get('minify_outputs', False):
+            writer.minifier = Minifier(
+                self.config.root_get('minify_extensions'))
+        # sidecars are for outputs served from the output folder
+        if (self.config.root_get('compress_outputs', False)
+                and writer.persistent):
+            writer.compressor = Compressor(
+                self.config.root_get('compress_extensions'),
+                self.config.root_get('compress_workers'))
+        return writer
+
     def get_storage(self, module):
         return self._storage.setdefault(module, {})
 
+    def get_cache(self, module):
+        """
+        Like `get_storage`, but the data is json-serialized into the cache
+        folder at the end of each build and loaded again by the next one.
+        """
+        if module not in self._caches:
+            filename = os.path.join(self.cache_folder, f'{module}.json')
+            try:
+                with open(filename, encoding='utf-8') as f:
+                    self._caches[module] = json.load(f)
+            except (OSError, ValueError):
+                self._caches[module] = {}
+        return self._caches[module]
+
+    def get_memo(self, module):
+        """
+        Like `get_storage`, but not cleared between builds.  Only a long
+        running builder (the daemon, the dev server) profits from it.
+        """
+        return self._memos.setdefault(module, {})
+
+    def _save_caches(self, modules=None):
+        for module, data in self._caches.items():
+            if modules is not None and module not in modules:
+                continue
+            filename = os.path.join(self.cache_folder, f'{module}.json')
+            atomic_write(filename, json.dumps(data).encode('utf-8'))
+
     def _filter_files(self, files, config):
         patterns = config.merged_get('ignore_files')
         if patterns is None:
@@ -366,23 +598,154 @@ class Builder(RouteAndTemplateMixin):
                 return True
         return False
 
-    def run(self, force_build: bool = False):
-
+    def _select_contexts(self, contexts, paths):
+        """
+        Returns the contexts matching any of `paths`.  A path is a source
+        file or folder, absolute or relative to the project folder, or a
+        glob matched against the source filenames.
+        """
+        patterns = []
+        for path in paths:
+            if os.path.isabs(path):
+                path = os.path.relpath(path, self.project_folder)
+            patterns.append(path.replace(os.sep, '/').rstrip('/'))
+        selected = set()
+        for pattern in patterns:
+            found = False
+            for context in contexts:
+                source = context.source_filename.replace(os.sep, '/')
+                if (source == pattern or source.startswith(pattern + '/')
+                        or fnmatch(source, pattern)):
+                    selected.add(context)
+                    found = True
+            if not found:
+                raise BuildError(f'no source file matches "{pattern}"')
+        return selected
+
+    def _start_build(self, force_build: bool = False) -> list:
+        """Starts a build and returns the prepared file contexts"""
         self._storage.clear()
+        self.writer.begin()
+        self.assets.begin()
         before_build.send(self)
-        contexts = list(self._iter_contexts())
+        # pages link to the fingerprinted names, rebuild all of them
+        # once any asset changed
+        if self.assets.changed:
+            force_build = True
+        self.force_build = force_build
+        contexts = list(self._iter_contexts(prepare=False))
+        self._phase('walk')
+        for context in contexts:
+            context.prepare()
+        self._phase('prepare')
+        return contexts
+
+    def _send_build_finished(self):
+        """
+        Sends `before_build_finished` and renders the listing pages its
+        receivers submitted.
+        """
+        self._listing_jobs = ListingJobs(
+            self.config.root_get('listing_workers'))
+        try:
+            before_build_finished.send(self)
+            jobs, self._listing_jobs = self._listing_jobs, None
+            if len(jobs) > 1:
+                # per build data the workers share
+                self._get_layout_signature()
+                self.get_cache('pages')
+            # the workers only render, pages are written in submission
+            # order so an archive is laid out the same way every build
+            for rendered in jobs.run():
+                self._write_link_file(rendered)
+        finally:
+            self._listing_jobs = None
+
+    def _finish_build(self):
+        self._send_build_finished()
+        self._phase('listing')
+        self.assets.write()
+        self.writer.finish()
+        # caches describe the outputs on disk, in-memory builds keep theirs
+        # to themselves
+        if self.writer.persistent:
+            self._save_caches()
+        self._phase('finish')
+
+    def _phase(self, name: str):
+        if self.memory_report is not None:
+            self.memory_report.sample(name)
+
+    def run(self, force_build: bool = False, paths=None):
+        """
+        Builds the project.  If `paths` are given only the matching files
+        are built, all others keep their last output but are still
+        prepared (from the build cache), so listing pages stay complete.
+        Once a fingerprinted asset changed every file is built anyway.
+        """
+        contexts = self._start_build(force_build)
+        force_build = self.force_build
+        selected = None
+        if paths:
+            selected = self._select_contexts(contexts, paths)
+            # the new asset manifest is saved, the unselected pages would
+            # keep linking to the old fingerprints
+            if self.assets.changed:
+                selected = None
 
         for context in contexts:
+            if selected is not None and context not in selected:
+                context.run(build=False)
+                continue
             key = context.is_new and 'A' or 'U'
-            context.run(force_build)
+            context.run(force_build or selected is not None)
             print(key, context.source_filename)
-
-        before_build_finished.send(self)
-
-    def debug_serve(self, host='0.0.0.0', port=5200):
+        self._phase('render')
+
+        self._finish_build()
+        # outputs of unselected files may be missing, not stale
+        if selected is None and self.config.root_get('prune_stale_outputs',
+                                                      False):
+            self.prune()
+
+    def prune(self):
+        for filename in self.writer.prune():
+            print('D', filename)
+
+    def clean(self):
+        for folder in (self.dest_folder, self.cache_folder):
+            if os.path.isdir(folder):
+                shutil.rmtree(folder)
+        self._caches.clear()
+        self.writer = self._make_writer()
+
+    def set_output(self, backend: str, target: str = None):
+        """
+        Switches the output backend: 'filesystem', 'memory' or 'archive'
+        (`target` is the archive filename).
+        """
+        self.writer = self._make_writer(backend, target)
+
+    def flush(self):
+        """
+        Writes the outputs of an in-memory build to the output folder.
+        """
+        if not isinstance(self.writer, MemoryOutputWriter):
+            return
+        self.writer.flush(self._make_writer('filesystem'))
+        # the caches describe the outputs on disk again
+        self._save_caches()
+
+    def debug_serve(self, host='0.0.0.0', port=5200, in_memory=False,
+                    flush=False, lazy=False):
         from blogme.server import Server
+        # lazy rendering always builds into memory
+        if in_memory or lazy:
+            self.set_output('memory')
         print('Serving on http://{}:{}{}'.format(host, port, self.prefix_path))
         try:
-            Server(host, port, self).serve_forever()
+            Server(host, port, self, self.config.root_get(
+                'live_reload', True), flush=flush,
+                lazy=lazy).serve_forever()
         except KeyboardInterrupt:
             pass
@@ -2,14 +2,28 @@
 
 import sys
 import os
-from blogme.config import Config
-from blogme.builder import Builder
+from typing import TYPE_CHECKING
 
+if TYPE_CHECKING:
+    from blogme.builder import Builder
 
-def get_builder(project_folder: str) -> Builder:
+
+actions = ('build', 'serve', 'rebuild', 'clean', 'daemon')
+
+usage = ('usage: blogme <action> [--project=<folder>|--stale|--stop|'
+         '--no-daemon|--memory|--flush|--lazy|--output=<archive>|'
+         '--profile-hooks[=<json>]|--profile-allocations|'
+         '--memory-report[=<json>]] [<folder>] [<path>...]')
+
+
+def get_builder(project_folder: str) -> 'Builder':
     """
     Runs the builder for the given project folder.
     """
+    # imported here, so that usage errors do not pay for jinja2 & co
+    from blogme.config import Config
+    from blogme.builder import Builder
+
     config_filename = os.path.join(project_folder, 'config.yml')
     config = Config()
     if not os.path.isfile(config_filename):
@@ -18,27 +32,146 @@ def get_builder(project_folder: str) -> Builder:
     return Builder(project_folder, config)
 
 
+def get_flag(flags, name):
+    """
+    Returns the value of `--name=value`, True for a bare `--name` and None
+    if the flag is not given.
+    """
+    for flag in flags:
+        if flag == f'--{name}':
+            return True
+        if flag.startswith(f'--{name}='):
+            return flag[len(name) + 3:]
+    return None
+
+
+def split_args(args, flags):
+    """
+    Splits the arguments after the action into the project folder and
+    the source paths to build.  The folder is `--project=<folder>`, or
+    the first argument if it holds a root config and is not a folder of
+    the project in the working directory.
+    """
+    project = get_flag(flags, 'project')
+    if isinstance(project, str):
+        return project, args
+    cwd = os.getcwd()
+    if args and os.path.isfile(os.path.join(args[0], 'config.yml')):
+        # content folders may have a config.yml of their own
+        inside = (os.path.isfile(os.path.join(cwd, 'config.yml'))
+                  and os.path.abspath(args[0]).startswith(cwd + os.sep))
+        if not inside:
+            return args[0], args[1:]
+    return cwd, args
+
+
+def _report(report, target):
+    # a bare flag prints the report, --flag=<file> writes it as json
+    if target is True:
+        print(report.report())
+    else:
+        import json
+        with open(target, 'w') as f:
+            json.dump(report.to_dict(), f, indent=2)
+
+
+def build(builder: 'Builder', force_build: bool, paths, profile=None,
+          memory=None, allocations=False):
+    """
+    Runs the builder, optionally profiling the signal receivers and
+    sampling the memory usage.
+    """
+    profiler = report = None
+    if memory is not None:
+        from blogme.memory import MemoryReport
+        report = builder.memory_report = MemoryReport()
+        report.start()
+    if profile is not None:
+        from blogme.signals import HookProfiler
+        profiler = HookProfiler(allocations)
+        profiler.start()
+    try:
+        builder.run(force_build=force_build, paths=paths)
+    finally:
+        if profiler is not None:
+            profiler.stop()
+        if report is not None:
+            report.stop()
+            builder.memory_report = None
+    if profiler is not None:
+        _report(profiler, profile)
+    if report is not None:
+        _report(report, memory)
+
+
 def main():
     """
     Entrypoint for the console script.
     """
-    if len(sys.argv) not in (1, 2, 3):
-        print('usage: blogme <action> <folder>')
-    if len(sys.argv) >= 2:
-        action = sys.argv[1]
+    args = [x for x in sys.argv[1:] if not x.startswith('--')]
+    flags = [x for x in sys.argv[1:] if x.startswith('--')]
+    if len(args) >= 1:
+        action = args[0]
     else:
         action = 'build'
-    if len(sys.argv) >= 3:
-        folder = sys.argv[2]
-    else:
-        folder = os.getcwd()
-    if action not in ('build', 'serve', 'rebuild'):
+    folder, paths = split_args(args[1:], flags)
+    if action not in actions:
         print('unknown action', action)
+        return
+    if paths and action not in ('build', 'rebuild'):
+        print(usage)
+        return
+    if paths and get_flag(flags, 'output') is not None:
+        # an archive is written from scratch, it has to hold every page
+        print('error: --output builds the whole site, no paths allowed')
+        print(usage)
+        sys.exit(2)
+    # existing paths are relative to the working directory, anything
+    # else is a glob relative to the project folder
+    paths = [os.path.abspath(x) if os.path.exists(x) else x for x in paths]
+
+    from blogme import daemon
+    if action == 'daemon':
+        if '--stop' in flags:
+            daemon.request(daemon.get_socket_path(folder), 'stop')
+        else:
+            daemon.serve(folder, get_builder)
+        return
+    # writes the build into an archive instead of the output folder
+    output = get_flag(flags, 'output')
+    if isinstance(output, str):
+        output = os.path.abspath(output)
+    profile = get_flag(flags, 'profile-hooks')
+    memory = get_flag(flags, 'memory-report')
+
+    # a running daemon builds faster than a fresh interpreter
+    if (action in ('build', 'rebuild') and '--no-daemon' not in flags
+            and output is None and profile is None and memory is None):
+        rv = daemon.request(daemon.get_socket_path(folder), action, paths)
+        if rv is not None:
+            sys.exit(0 if rv else 1)
+
     builder = get_builder(folder)
+    if output is not None:
+        builder.set_output('archive', output)
 
-    if action == 'build':
-        builder.run()
-    elif action == 'rebuild':
-        builder.run(force_build=True)
+    if action in ('build', 'rebuild'):
+        from blogme.builder import BuildError
+        try:
+            build(builder, action == 'rebuild', paths, profile, memory,
+                  '--profile-allocations' in flags)
+        except BuildError as e:
+            if not paths:
+                raise
+            print(f'error: {e}')
+            print(usage)
+            sys.exit(2)
+    elif action == 'clean':
+        if '--stale' in flags:
+            builder.prune()
+        else:
+            builder.clean()
     else:
-        builder.debug_serve()
+        builder.debug_serve(in_memory='--memory' in flags,
+                            flush='--flush' in flags,
+                            lazy='--lazy' in flags)
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+pre-compressed sidecars (.gz, .br) for outputs, as served by
+nginx' gzip_static / brotli_static
+"""
+
+import os
+import gzip
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Iterable
+
+from blogme.output import atomic_write
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class Compressor:
+    """
+    public attr
+        - extensions            // compressed file extensions
+        - suffixes              // sidecar suffixes, '.gz' and maybe '.br'
+
+    public method
+        - wants                 // should this file get sidecars
+        - missing               // is any sidecar of this file missing
+        - submit                // compress in the thread pool
+        - wait                  // wait for all submitted files
+    """
+    default_extensions = ('.html', '.css', '.js', '.xml', '.atom', '.json',
+                          '.svg', '.txt')
+
+    def __init__(self, extensions: Optional[Iterable[str]] = None,
+                 workers: Optional[int] = None):
+        self.extensions = frozenset(extensions or self.default_extensions)
+        self.suffixes = ['.gz']
+        if brotli is not None:
+            self.suffixes.append('.br')
+        self._workers = workers
+        self._executor = None
+        self._futures = []
+        # a file written twice in one build must end up with the sidecars
+        # of its last content, whatever order the jobs finish in
+        self._lock = threading.Lock()
+        self._latest = {}
+
+    def wants(self, filename: str) -> bool:
+        return os.path.splitext(filename)[1] in self.extensions
+
+    def missing(self, filename: str) -> bool:
+        return not all(os.path.exists(filename + suffix)
+                       for suffix in self.suffixes)
+
+    def submit(self, filename: str, data: Optional[bytes] = None) -> None:
+        token = object()
+        # listing pages are submitted from several threads
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self._workers)
+            self._latest[filename] = token
+            self._futures.append(
+                self._executor.submit(self._compress, filename, data, token))
+
+    def wait(self) -> None:
+        futures, self._futures = self._futures, []
+        try:
+            for future in futures:
+                future.result()
+        finally:
+            self._latest.clear()
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+    def _compress(self, filename: str, data: Optional[bytes],
+                  token: object) -> None:
+        if data is None:
+            with open(filename, 'rb') as f:
+                data = f.read()
+        # mtime=0 keeps the .gz stable for identical input
+        sidecars = [('.gz', gzip.compress(data, compresslevel=9, mtime=0))]
+        if brotli is not None:
+            sidecars.append(('.br', brotli.compress(data, quality=11)))
+        with self._lock:
+            if self._latest.get(filename) is not token:
+                return
+            for suffix, compressed in sidecars:
+                atomic_write(filename + suffix, compressed)
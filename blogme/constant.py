@@ -5,4 +5,4 @@ FILE_META_TITLE = 'title'
 FILE_META_SUMMARY = 'summary'
 FILE_META_TYPE = 'type'
 FILE_CONFIG_TEMPLATE = 'template'
-
+SUMMARY_MARKER = '<!-- more -->'
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""
+a long running builder behind a unix socket
+
+`blogme daemon` keeps one warm `Builder` (modules, templates, caches,
+markdown engines and parsed front matter) and builds on request.  The
+protocol is line based json, one request per connection:
+
+    client:  {"action": "build", "paths": ["posts/*.md"]}
+    daemon:  {"log": "U about.md"}
+             ...
+             {"status": "ok"}
+
+`blogme build` and `blogme rebuild` talk to a running daemon through
+`request` and fall back to building themselves if none answers.
+"""
+
+import os
+import sys
+import json
+import socket
+import socketserver
+from contextlib import redirect_stdout
+from typing import Callable, IO, Optional
+
+#: the socket is created in the project folder, ignored by the builder
+socket_filename = '.blogme-daemon.sock'
+
+actions = ('build', 'rebuild', 'ping', 'stop')
+
+
+def get_socket_path(project_folder: str) -> str:
+    return os.path.join(os.path.abspath(project_folder), socket_filename)
+
+
+class LineStream:
+    """A file-ish object that sends every printed line as a log message"""
+
+    def __init__(self, send: Callable[[dict], None]):
+        self._send = send
+        self._buffer = ''
+
+    def write(self, data: str) -> int:
+        self._buffer += data
+        *lines, self._buffer = self._buffer.split('\n')
+        for line in lines:
+            self._send({'log': line})
+        return len(data)
+
+    def flush(self):
+        return
+
+    def close(self):
+        if self._buffer:
+            self._send({'log': self._buffer})
+            self._buffer = ''
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+
+    def send(self, message: dict):
+        self.wfile.write(json.dumps(message).encode('utf-8') + b'\n')
+        self.wfile.flush()
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline().decode('utf-8'))
+        except ValueError:
+            self.send({'status': 'error', 'message': 'invalid request'})
+            return
+        action = request.get('action')
+        if action not in actions:
+            self.send({'status': 'error',
+                       'message': f'unknown action {action}'})
+            return
+        paths = request.get('paths') or None
+        try:
+            stream = LineStream(self.send)
+            with redirect_stdout(stream):
+                self.server.handle_action(action, paths)
+            stream.close()
+        except BrokenPipeError:
+            return
+        except Exception as e:
+            self.send({'status': 'error', 'message': f'{type(e).__name__}: '
+                                                     f'{e}'})
+            return
+        self.send({'status': 'ok'})
+
+
+class Daemon(socketserver.UnixStreamServer):
+    """
+    Serves builds of one project, one request at a time.  The builder is
+    created again if the root config changed or another process built
+    the project meanwhile.
+
+    public attr
+        - project_folder
+        - socket_path
+    public method
+        - serve_forever
+        - handle_action
+    """
+
+    def __init__(self, project_folder: str, get_builder: Callable,
+                 socket_path: Optional[str] = None):
+        self.project_folder = os.path.abspath(project_folder)
+        self.socket_path = socket_path or get_socket_path(project_folder)
+        self._get_builder = get_builder
+        self._builder = None
+        self._signature = None
+        self._stopping = False
+        self._remove_stale_socket()
+        super().__init__(self.socket_path, RequestHandler)
+
+    def _remove_stale_socket(self):
+        if not os.path.exists(self.socket_path):
+            return
+        if ping(self.socket_path):
+            raise RuntimeError(f'a daemon is running on {self.socket_path}')
+        os.unlink(self.socket_path)
+
+    def _get_signature(self, builder=None) -> tuple:
+        rv = []
+        filenames = [os.path.join(self.project_folder, 'config.yml')]
+        if builder is not None:
+            filenames.append(builder.writer.manifest_filename)
+        for filename in filenames:
+            try:
+                rv.append(os.stat(filename).st_mtime_ns)
+            except OSError:
+                rv.append(None)
+        return tuple(rv)
+
+    @property
+    def builder(self):
+        if (self._builder is None
+                or self._get_signature(self._builder) != self._signature):
+            self._builder = self._get_builder(self.project_folder)
+            self._signature = self._get_signature(self._builder)
+        return self._builder
+
+    def handle_action(self, action: str, paths: Optional[list] = None):
+        if action == 'stop':
+            self._stopping = True
+        elif action in ('build', 'rebuild'):
+            builder = self.builder
+            builder.run(force_build=action == 'rebuild', paths=paths)
+            self._signature = self._get_signature(builder)
+
+    def serve_forever(self, poll_interval=None):
+        # shutdown() would wait for this very loop if sent by a request
+        while not self._stopping:
+            self.handle_request()
+
+    def server_close(self):
+        super().server_close()
+        try:
+            os.unlink(self.socket_path)
+        except OSError:
+            pass
+
+
+def request(socket_path: str, action: str, paths: Optional[list] = None,
+            out: IO = None) -> Optional[bool]:
+    """
+    Sends `action` to the daemon and copies its log to `out`.  Returns
+    whether it succeeded, or None if no daemon listens on the socket.
+    """
+    if out is None:
+        out = sys.stdout
+    if not os.path.exists(socket_path):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except OSError:
+        sock.close()
+        return None
+    with sock, sock.makefile('rwb') as f:
+        message = {'action': action, 'paths': paths or []}
+        f.write(json.dumps(message).encode('utf-8') + b'\n')
+        f.flush()
+        for line in f:
+            message = json.loads(line.decode('utf-8'))
+            if 'log' in message:
+                print(message['log'], file=out)
+            elif message.get('status') == 'ok':
+                return True
+            else:
+                print('daemon error:', message.get('message'), file=out)
+                return False
+    return False
+
+
+def ping(socket_path: str) -> bool:
+    return bool(request(socket_path, 'ping'))
+
+
+def serve(project_folder: str, get_builder: Callable):
+    daemon = Daemon(project_folder, get_builder)
+    print(f'Listening on {daemon.socket_path}')
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daemon.server_close()
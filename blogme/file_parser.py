@@ -4,26 +4,67 @@ define some kind of file parser
 """
 
 import os
-import shutil
+import threading
 from datetime import datetime, date
 from io import StringIO
 from weakref import ref
-from typing import TYPE_CHECKING, Optional
+from typing import TYPE_CHECKING, Callable, Dict, Optional
 from abc import ABC, abstractmethod
 import yaml
-from markdown import Markdown
-from markdown.extensions.codehilite import CodeHiliteExtension
 from jinja2 import Markup
-from docutils.core import publish_parts
 
 from blogme.constant import *
-from blogme.md_ext import MermaidExtension
 
 
 if TYPE_CHECKING:
     from blogme.builder import FileContext
 
 
+#: rst directives by name, each a callable returning the directive class.
+#: docutils is only imported once an rst file is rendered, modules add
+#: their directives here instead of registering them with docutils.
+rst_directives: Dict[str, Callable[[], type]] = {}
+_registered_directives = set()
+
+
+def _register_rst_directives():
+    from docutils.parsers.rst import directives
+    for name, factory in rst_directives.items():
+        if name not in _registered_directives:
+            directives.register_directive(name, factory())
+            _registered_directives.add(name)
+
+
+def _encode_meta(value):
+    """Turns parsed front matter into json, dates are tagged"""
+    if isinstance(value, datetime):
+        return {'$datetime': value.isoformat()}
+    if isinstance(value, date):
+        return {'$date': value.isoformat()}
+    if isinstance(value, dict):
+        if not all(isinstance(x, str) for x in value):
+            raise TypeError('front matter keys must be strings')
+        return {k: _encode_meta(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_encode_meta(x) for x in value]
+    if value is None or isinstance(value, (str, int, float)):
+        return value
+    raise TypeError(f'cannot encode {type(value).__name__}')
+
+
+def _decode_meta(value):
+    if isinstance(value, dict):
+        if len(value) == 1:
+            if '$datetime' in value:
+                return datetime.fromisoformat(value['$datetime'])
+            if '$date' in value:
+                return date.fromisoformat(value['$date'])
+        return {k: _decode_meta(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_decode_meta(x) for x in value]
+    return value
+
+
 class BaseParser(ABC):
     """
     parse file for specific format
@@ -66,6 +107,12 @@ class BaseParser(ABC):
         """
         raise NotImplementedError()
 
+    def update_summary(self):
+        """
+        fill in a missing summary of file meta
+        """
+        return
+
 
 class CopyParser(BaseParser):
     """A program that copies a file over unchanged"""
@@ -77,9 +124,9 @@ class CopyParser(BaseParser):
         return ''
 
     def run(self):
-        self.context.make_destination_folder()
-        shutil.copy(self.context.full_source_filename,
-                    self.context.full_destination_filename)
+        self.context.builder.writer.copy(
+            self.context.full_source_filename,
+            self.context.full_destination_filename)
 
     def get_desired_filename(self):
         return self.context.source_filename
@@ -97,8 +144,7 @@ class TemplateParser(BaseParser):
     def _parse_title_from_content(self, f) -> Optional[str]:
         raise NotImplementedError()
 
-    def prepare(self):
-        """ parse file meta """
+    def _read_front_matter(self):
         headers = []
         with self.context.open_source_file() as f:
             for line in f:
@@ -115,6 +161,36 @@ class TemplateParser(BaseParser):
             cfg = yaml.safe_load(StringIO('\n'.join(headers)))
         except Exception as e:
             raise Exception(f'file meta error, meta={headers}') from e
+        return cfg, title
+
+    def _load_front_matter(self, key: list):
+        cache = self.context.builder.get_cache('front_matter')
+        cached = cache.get(self.context.source_filename)
+        if cached is not None and cached[0] == key:
+            return _decode_meta(cached[1]), cached[2]
+        cfg, title = self._read_front_matter()
+        try:
+            cache[self.context.source_filename] = \
+                [key, _encode_meta(cfg), title]
+        except TypeError:
+            # not representable in json, parsed again next time
+            cache.pop(self.context.source_filename, None)
+        return cfg, title
+
+    def prepare(self):
+        """ parse file meta """
+        # front matter is parsed again only once the file changed, the
+        # build cache keeps it between processes, the memo within one
+        st = os.stat(self.context.full_source_filename)
+        key = [type(self).__name__, st.st_size, st.st_mtime_ns]
+        memo = self.context.builder.get_memo('front_matter')
+        cached = memo.get(self.context.source_filename)
+        if cached is None or cached[0] != key:
+            cached = memo[self.context.source_filename] = \
+                (key, self._load_front_matter(key))
+        cfg, title = cached[1]
+        if isinstance(cfg, dict):
+            cfg = dict(cfg)
 
         if cfg:
             if not isinstance(cfg, dict):
@@ -147,6 +223,44 @@ class TemplateParser(BaseParser):
             if summary is not None:
                 self.context.meta.summary = summary
 
+        if self.context.meta.summary is None and self._auto_summary:
+            cached = self.context.builder.get_cache('summaries').get(
+                self.context.source_filename)
+            if cached and cached[0] == self._get_summary_signature():
+                self.context.meta.summary = cached[1]
+
+    @property
+    def _auto_summary(self) -> bool:
+        return self.context.config.get('auto_summary', False)
+
+    def _get_summary_signature(self) -> list:
+        st = os.stat(self.context.full_source_filename)
+        return [st.st_size, st.st_mtime_ns,
+                self.context.config.get('summary_length', 120)]
+
+    def update_summary(self):
+        """
+        generate the summary from the rendered body, either everything
+        before a `<!-- more -->` marker or the first `summary_length`
+        characters, and keep it in the build cache so the body is not
+        rendered again just for its summary.
+        """
+        if self.context.meta.summary is not None or not self._auto_summary:
+            return
+        content = str(self.parsed['content'])
+        marker = content.find(SUMMARY_MARKER)
+        if marker != -1:
+            summary = Markup(content[:marker]).striptags()
+        else:
+            length = self.context.config.get('summary_length', 120)
+            summary = Markup(content).striptags()
+            if len(summary) > length:
+                summary = summary[:length].rstrip() + '…'
+        self.context.meta.summary = summary
+        self.context.builder.get_cache('summaries')[
+            self.context.source_filename] = [
+            self._get_summary_signature(), summary]
+
     def get_desired_filename(self):
         base, _ = os.path.splitext(self.context.source_filename)
         return f'{base}.html'
@@ -176,6 +290,7 @@ class TemplateParser(BaseParser):
         rv = self.context.render_template(template_name, context)
         with self.context.open_destination_file() as f:
             f.write(rv + '\n')
+        self.update_summary()
 
 
 class RSTParser(TemplateParser):
@@ -193,6 +308,8 @@ class RSTParser(TemplateParser):
         return self._render_rst('\n'.join(buffer)).get('title')
 
     def _render_rst(self, contents: str) -> dict:
+        from docutils.core import publish_parts
+        _register_rst_directives()
         settings = {
             'initial_header_level': self.context.config.get(
                 'rst_header_level', 2),
@@ -226,30 +343,45 @@ class MDParser(TemplateParser):
     A program that renders an markdown file into a template
     """
 
-    def __init__(self, context: 'FileContext'):
-        style = context.config.root_get('modules.pygments.style')
-        c = CodeHiliteExtension(
-            pygments_style=style or 'tango', guess_lang='True')
-        mermaid = MermaidExtension()
-        self.md = Markdown(
-            output_format='html5',
-            safe_mode='escape',
-            enable_attributes=True,
-            extensions=[
-                'meta', 'fenced_code', 'footnotes', 'attr_list',
-                'def_list', 'tables', 'abbr', c, mermaid
-            ]
-        )
-        super().__init__(context)
+    @property
+    def md(self):
+        """
+        The engine of the calling thread: posts are parsed on the main
+        thread, but listing pages show their contents from the workers.
+        """
+        from markdown import Markdown
+        from markdown.extensions.codehilite import CodeHiliteExtension
+        from blogme.md_ext import MermaidExtension
+
+        style = self.context.config.root_get('modules.pygments.style')
+        # engines are expensive to set up, keep one per style and thread,
+        # they go away with the worker threads of the build that made them
+        local = self.context.builder.get_memo('markdown').setdefault(
+            style, threading.local())
+        if getattr(local, 'md', None) is None:
+            c = CodeHiliteExtension(
+                pygments_style=style or 'tango', guess_lang='True')
+            mermaid = MermaidExtension()
+            local.md = Markdown(
+                output_format='html5',
+                safe_mode='escape',
+                enable_attributes=True,
+                extensions=[
+                    'meta', 'fenced_code', 'footnotes', 'attr_list',
+                    'def_list', 'tables', 'abbr', c, mermaid
+                ]
+            )
+        return local.md
 
     def _parse_title_from_content(self, f) -> Optional[str]:
         return
 
     def parse(self) -> dict:
 
-        self.md.reset()
+        md = self.md
+        md.reset()
         with self.context.open_source_file() as f:
-            parsed = self.md.convert(f.read())
+            parsed = md.convert(f.read())
         post = dict(
             content=Markup(parsed),
         )
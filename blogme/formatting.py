@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+memoized babel date formatting
+"""
+
+import datetime as _datetime
+from functools import lru_cache
+from typing import TYPE_CHECKING, Optional, Union
+
+if TYPE_CHECKING:
+    from babel import Locale
+
+
+@lru_cache(maxsize=None)
+def get_locale(name: str) -> 'Locale':
+    from babel import Locale
+    return Locale.parse(name)
+
+
+class DateFormatter:
+    """
+    Formats dates like `babel.dates`, but keeps locales and results
+    around: a build formats the same few dates over and over again.
+
+    public method
+        - format_date
+        - format_datetime
+        - format_time
+    """
+
+    def __init__(self, locale: Union[str, 'Locale'] = 'zh',
+                 cache_size: int = 8192):
+        self._locale = locale
+        self._format = lru_cache(maxsize=cache_size)(self._format_uncached)
+
+    @property
+    def locale(self) -> 'Locale':
+        if isinstance(self._locale, str):
+            self._locale = get_locale(self._locale)
+        return self._locale
+
+    def _get_locale(self, locale: Optional[str]) -> 'Locale':
+        return get_locale(locale) if locale else self.locale
+
+    def _format_uncached(self, kind, value, format, locale):
+        from babel import dates
+        locale = self._get_locale(locale)
+        if kind == 'date':
+            return dates.format_date(value, format, locale=locale)
+        if kind == 'datetime':
+            return dates.format_datetime(value, format, locale=locale)
+        return dates.format_time(value, format, locale=locale)
+
+    def format_date(self, date=None, format='medium', locale=None):
+        if date is None:
+            date = _datetime.date.today()
+        return self._format('date', date, format, locale)
+
+    def format_datetime(self, datetime=None, format='medium', locale=None):
+        # no caching of "now"
+        if datetime is None:
+            return self._format_uncached('datetime', None, format, locale)
+        return self._format('datetime', datetime, format, locale)
+
+    def format_time(self, time=None, format='medium', locale=None):
+        if time is None:
+            return self._format_uncached('time', None, format, locale)
+        return self._format('time', time, format, locale)
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""
+listing pages rendered in a thread pool once the build is finished
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Hashable, List, Optional
+
+
+class ListingJobs:
+    """
+    Collects the render jobs of listing pages (index, archive and tag
+    pages ...) submitted while `before_build_finished` is sent and runs
+    them in a bounded thread pool.  A job submitted for an output that
+    already has one replaces it, and results are handed back in the
+    order the jobs were submitted, so the outputs do not depend on the
+    order the workers finish in.
+
+    public method
+        - submit
+        - run                   // run all jobs, returns their results
+    """
+
+    def __init__(self, workers: Optional[int] = None):
+        self.workers = workers
+        self._jobs = {}
+
+    def __len__(self) -> int:
+        return len(self._jobs)
+
+    def submit(self, key: Hashable, func: Callable, *args) -> None:
+        self._jobs.pop(key, None)
+        self._jobs[key] = (func, args)
+
+    def run(self) -> List:
+        jobs, self._jobs = list(self._jobs.values()), {}
+        if (self.workers is not None and self.workers <= 1) or len(jobs) < 2:
+            return [func(*args) for func, args in jobs]
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(func, *args) for func, args in jobs]
+            # the first failing job in submission order raises
+            return [future.result() for future in futures]
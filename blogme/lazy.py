@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+render outputs of an in-memory build when they are requested
+"""
+
+import os
+import threading
+from typing import TYPE_CHECKING, List
+
+from werkzeug.exceptions import HTTPException
+
+if TYPE_CHECKING:
+    from blogme.builder import Builder
+
+
+class LazyRenderer:
+    """
+    Prepares every file of the project but renders an output only once
+    it is requested.  A request is mapped back to the file context that
+    produces it, or through the url map to a producer registered with
+    `Builder.register_producer`; outputs without either are rendered by
+    finishing the whole build once.  Rendered outputs are remembered
+    until a source changes.
+
+    public attr
+        - builder
+    public method
+        - needs_refresh         // whether a source changed
+        - prepare               // start over after a source changed
+        - render                // make sure an output is rendered
+        - refresh               // prepare again, re-render what was shown
+    """
+
+    def __init__(self, builder: 'Builder'):
+        if builder.writer.persistent:
+            builder.set_output('memory')
+        self.builder = builder
+        self._lock = threading.RLock()
+        self._contexts = {}
+        self._rendered = set()
+        self._finished = False
+        self._prepared = False
+        self._sources = {}
+
+    def _snapshot(self, contexts) -> dict:
+        return {x.source_filename: os.stat(x.full_source_filename).st_mtime_ns
+                for x in contexts}
+
+    def needs_refresh(self) -> bool:
+        # unrequested outputs never exist, so `anything_needs_build`
+        # would always say yes
+        if not self._prepared:
+            return True
+        return self._snapshot(
+            self.builder._iter_contexts(prepare=False)) != self._sources
+
+    def prepare(self) -> None:
+        with self._lock:
+            contexts = self.builder._start_build()
+            self._sources = self._snapshot(contexts)
+            self._contexts = {x.destination_filename.replace('\\', '/'): x
+                              for x in contexts}
+            self._rendered = set()
+            self._finished = False
+            # fingerprinted static files are needed by every page
+            self.builder.assets.write()
+            self._prepared = True
+
+    def _produce(self, rel: str) -> bool:
+        context = self._contexts.get(rel)
+        if context is not None:
+            context.run(self.builder.force_build)
+            return True
+        path = '/' + rel
+        if path.endswith('/index.html'):
+            path = path[:-len('index.html')]
+        try:
+            key, values = self.builder._url_adapter.match(path)
+        except HTTPException:
+            return False
+        producer = self.builder.get_producer(key)
+        return producer is not None and producer(self.builder, **values)
+
+    def _finish(self) -> None:
+        self.builder._send_build_finished()
+        self.builder.assets.write()
+        self._finished = True
+
+    def render(self, rel: str) -> bool:
+        """
+        Renders the output `rel` (relative to the output folder) unless it
+        is current.  Returns False if nothing produces it.
+        """
+        with self._lock:
+            if not self._prepared:
+                self.prepare()
+            writer = self.builder.writer
+            if rel in self._rendered and writer.lookup(rel) is not None:
+                return True
+            # static files are copied before anything is rendered, only
+            # outputs nothing produced yet (feeds, sitemaps) need the rest
+            # of the build
+            if (not self._produce(rel) and not self._finished
+                    and not writer.produced(rel)):
+                self._finish()
+            if writer.lookup(rel) is None:
+                return False
+            self._rendered.add(rel)
+            return True
+
+    def refresh(self) -> List[str]:
+        """
+        Prepares again and renders the outputs rendered so far.  Returns
+        the relative filenames that changed.
+        """
+        with self._lock:
+            shown = sorted(self._rendered)
+            self.prepare()
+            for rel in shown:
+                self.render(rel)
+            writer = self.builder.writer
+            return writer.added + writer.changed
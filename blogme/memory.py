@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+memory usage of a build, sampled with tracemalloc at phase boundaries
+"""
+
+import os
+import time
+import tracemalloc
+from typing import Dict, List, Optional
+
+_package_folder = os.path.dirname(os.path.abspath(__file__))
+
+_ignored_files = {tracemalloc.__file__, __file__}
+
+_subsystems: Dict[str, Optional[str]] = {}
+
+
+def _get_file_subsystem(filename: str) -> Optional[str]:
+    rv = _subsystems.get(filename, False)
+    if rv is not False:
+        return rv
+    path = os.path.abspath(filename)
+    rv = None
+    if path.startswith(_package_folder + os.sep):
+        rel = path[len(_package_folder) + 1:]
+        rv = rel[:-3].replace(os.sep, '.') if rel.endswith('.py') \
+            else 'templates'
+    _subsystems[filename] = rv
+    return rv
+
+
+def get_subsystem(traceback: tracemalloc.Traceback) -> str:
+    """
+    Names the innermost blogme frame of an allocation: `builder`,
+    `file_parser`, `modules.tags`, `templates` (compiled templates) ...
+    or `other` if no blogme code is involved.
+    """
+    for frame in reversed(traceback):
+        rv = _get_file_subsystem(frame.filename)
+        if rv is not None:
+            return rv
+    return 'other'
+
+
+def get_rss() -> Optional[int]:
+    """Current resident set size in bytes, if the platform tells"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def get_peak_rss() -> Optional[int]:
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macos
+    return peak if os.uname().sysname == 'Darwin' else peak * 1024
+
+
+class MemoryReport:
+    """
+    Set as `Builder.memory_report`, it samples the traced memory at the
+    end of every build phase (walk, prepare, render, listing, finish).
+
+    public attr
+        - phases                // one dict per sample
+    public method
+        - start
+        - stop
+        - sample
+        - to_dict
+        - report                // a printable summary
+    """
+
+    def __init__(self, frames: int = 10, top: int = 10):
+        self.frames = frames
+        self.top = top
+        self.phases: List[dict] = []
+        self._started = None
+        self._started_tracemalloc = False
+
+    def start(self) -> None:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self._started_tracemalloc = True
+        self._started = time.perf_counter()
+
+    def stop(self) -> None:
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+    def _summarize(self, snapshot: tracemalloc.Snapshot):
+        # one pass over the grouped tracebacks gives both the subsystems
+        # and the allocation sites, filter_traces would be slower
+        groups, sites = {}, {}
+        for stat in snapshot.statistics('traceback'):
+            frame = stat.traceback[-1]
+            if frame.filename in _ignored_files:
+                continue
+            name = get_subsystem(stat.traceback)
+            groups[name] = groups.get(name, 0) + stat.size
+            site = sites.setdefault((frame.filename, frame.lineno), [0, 0])
+            site[0] += stat.size
+            site[1] += stat.count
+        top = sorted(sites.items(), key=lambda x: -x[1][0])[:self.top]
+        return (dict(sorted(groups.items(), key=lambda x: -x[1])),
+                [{'site': f'{filename}:{lineno}', 'size': size,
+                  'count': count}
+                 for (filename, lineno), (size, count) in top])
+
+    def sample(self, phase: str) -> None:
+        if not tracemalloc.is_tracing():
+            return
+        current, peak = tracemalloc.get_traced_memory()
+        subsystems, top = self._summarize(tracemalloc.take_snapshot())
+        self.phases.append({
+            'phase':        phase,
+            'time':         time.perf_counter() - self._started,
+            'traced':       current,
+            'traced_peak':  peak,
+            'rss':          get_rss(),
+            'rss_peak':     get_peak_rss(),
+            'subsystems':   subsystems,
+            'top':          top,
+        })
+        # the peak of every phase on its own
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+
+    def to_dict(self) -> dict:
+        return {'frames': self.frames, 'phases': self.phases}
+
+    def report(self) -> str:
+        mb = 1024 * 1024
+        lines = [f'{"phase":<10} {"traced MB":>10} {"peak MB":>10} '
+                 f'{"rss MB":>8}  largest subsystems']
+        for x in self.phases:
+            rss = f'{x["rss"] / mb:8.1f}' if x['rss'] is not None \
+                else f'{"-":>8}'
+            largest = ', '.join(f'{k} {v / mb:.1f}' for k, v in
+                                list(x['subsystems'].items())[:3])
+            lines.append(f'{x["phase"]:<10} {x["traced"] / mb:10.1f} '
+                         f'{x["traced_peak"] / mb:10.1f} {rss}  {largest}')
+        if self.phases and self.phases[-1]['rss_peak'] is not None:
+            lines.append(f'peak rss: {self.phases[-1]["rss_peak"] / mb:.1f} '
+                         f'MB')
+        return '\n'.join(lines)
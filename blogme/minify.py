@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+whitespace & comment minification for html and css outputs
+"""
+
+import os
+import re
+from typing import Iterator, Iterable
+
+
+_html_token_re = re.compile(r'''
+    (?P<comment><!--.*?-->)
+  | (?P<raw><(?P<raw_tag>pre|textarea|script|style)\b[^>]*>.*?</(?P=raw_tag)\s*>)
+  | (?P<mermaid><div\s[^>]*\bclass=["']?mermaid\b[^>]*>.*?</div\s*>)
+  | (?P<tag><[^>]*>)
+  | (?P<text>[^<]+|<)
+''', re.S | re.I | re.X)
+
+_tag_name_re = re.compile(r'</?\s*([a-zA-Z0-9!]+)')
+_attr_split_re = re.compile(r'''("[^"]*"|'[^']*')''')
+# not \s, that would also eat non-breaking spaces
+_space_re = re.compile(r'[ \t\n\r\f\v]+')
+
+# whitespace next to these tags never renders
+_block_tags = frozenset('''
+    !doctype html head body title meta link base script style noscript
+    div p ul ol li dl dt dd nav header footer section article aside main
+    h1 h2 h3 h4 h5 h6 table thead tbody tfoot tr td th caption colgroup col
+    form fieldset legend hr br blockquote figure figcaption pre
+'''.split())
+
+_css_token_re = re.compile(r'''
+    (?P<comment>/\*(?!!).*?\*/)
+  | (?P<string>"(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')
+  | (?P<space>\s+)
+  | (?P<other>[^"'/\s]+|/)
+''', re.S | re.X)
+
+_css_tight_re = re.compile(r'\s*([{};,])\s*')
+
+
+def _tag_name(tag: str) -> str:
+    match = _tag_name_re.match(tag)
+    return match.group(1).lower() if match else ''
+
+
+def _minify_tag(tag: str) -> str:
+    parts = _attr_split_re.split(tag)
+    for idx in range(0, len(parts), 2):
+        parts[idx] = _space_re.sub(' ', parts[idx])
+    rv = ''.join(parts).replace(' >', '>')
+    if rv.endswith(' />'):
+        # the slash would end up in an unquoted value: href=/x/ />
+        last = rv[:-3].rsplit(' ', 1)[-1]
+        if '=' not in last or last[-1] in '"\'':
+            rv = rv[:-3] + '/>'
+    return rv
+
+
+def iter_minify_html(text: str) -> Iterator[str]:
+    """
+    Yields the minified html piece by piece.  <pre>, <textarea>,
+    <script>, <style> and mermaid <div> blocks are passed through as is.
+    """
+    pending_space = False
+    last_block = True
+    for match in _html_token_re.finditer(text):
+        kind = match.lastgroup
+        token = match.group(kind)
+        if kind == 'comment':
+            # keep conditional comments
+            if token.startswith('<!--[if'):
+                yield token
+            continue
+        if kind == 'text':
+            stripped = _space_re.sub(' ', token)
+            if not stripped.strip():
+                pending_space = True
+                continue
+            if stripped[0] == ' ':
+                pending_space = True
+                stripped = stripped[1:]
+            if pending_space and not last_block:
+                yield ' '
+            pending_space = stripped[-1] == ' '
+            last_block = False
+            yield stripped.rstrip(' ')
+            continue
+
+        if kind in ('raw', 'mermaid'):
+            name = (match.group('raw_tag') or 'div').lower()
+        else:
+            name = _tag_name(token)
+            token = _minify_tag(token)
+        is_block = name in _block_tags
+        if pending_space and not last_block and not is_block:
+            yield ' '
+        pending_space = False
+        last_block = is_block
+        yield token
+
+
+def iter_minify_css(text: str) -> Iterator[str]:
+    """
+    Yields the minified css piece by piece, strings and /*! */ comments
+    are left alone.
+    """
+    buffer = []
+    for match in _css_token_re.finditer(text):
+        kind = match.lastgroup
+        if kind == 'comment':
+            continue
+        if kind == 'string':
+            if buffer:
+                yield _minify_css_code(''.join(buffer))
+                buffer = []
+            yield match.group(kind)
+        else:
+            buffer.append(match.group(kind))
+    if buffer:
+        yield _minify_css_code(''.join(buffer))
+
+
+def _minify_css_code(code: str) -> str:
+    code = _space_re.sub(' ', code)
+    code = _css_tight_re.sub(r'\1', code)
+    return code.replace(': ', ':').replace(';}', '}')
+
+
+class Minifier:
+    """
+    public attr
+        - extensions            // minified file extensions
+
+    public method
+        - wants                 // should this file be minified
+        - minify                // minified bytes of a file
+    """
+    minifiers = {
+        '.html': iter_minify_html,
+        '.htm': iter_minify_html,
+        '.css': iter_minify_css,
+    }
+
+    def __init__(self, extensions: Iterable[str] = None):
+        self.extensions = frozenset(extensions or self.minifiers)
+
+    def wants(self, filename: str) -> bool:
+        ext = os.path.splitext(filename)[1]
+        return ext in self.extensions and ext in self.minifiers
+
+    def minify(self, filename: str, data: bytes) -> bytes:
+        minifier = self.minifiers[os.path.splitext(filename)[1]]
+        text = data.decode('utf-8')
+        return ''.join(minifier(text)).encode('utf-8')
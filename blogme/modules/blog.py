@@ -2,15 +2,14 @@
 
 import os
 import math
-import shutil
+import itertools
+from collections.abc import Sequence
 from datetime import datetime, date
-from urllib.parse import urljoin
 from typing import List
 import functools
 
 from jinja2 import contextfunction, Markup
 from werkzeug.routing import Rule, Map, NotFound
-# from werkzeug.contrib.atom import AtomFeed
 
 from blogme.signals import (
     after_file_published,
@@ -38,7 +37,7 @@ class Pagination:
         return int(math.ceil(self.total / float(self.per_page)))
 
     def get_prev(self):
-        return Pagination(self.builder, self.entries, self.page - 1,
+        return type(self)(self.builder, self.entries, self.prev_num,
                           self.per_page, self.url_key)
 
     @property
@@ -52,7 +51,7 @@ class Pagination:
         return self.page > 1
 
     def get_next(self):
-        return Pagination(self.builder, self.entries, self.page + 1,
+        return type(self)(self.builder, self.entries, self.next_num,
                           self.per_page, self.url_key)
 
     @property
@@ -69,6 +68,9 @@ class Pagination:
         return self.entries[(self.page - 1) * self.per_page:
                             self.page * self.per_page]
 
+    def url_for(self, page):
+        return self.builder.link_to(self.url_key, page=page)
+
     def iter_pages(self, left_edge=2, left_current=2,
                    right_current=5, right_edge=2):
         """Iterates over the page numbers in the pagination.  The four
@@ -94,6 +96,61 @@ class Pagination:
         return Markup(str(self))
 
 
+class StablePagination(Pagination):
+    """
+    Pages are numbered from the oldest entries on, so a new post only
+    changes the newest page.  `entries` are oldest first, page `pages`
+    holds the newest entries and "previous" points to newer ones.
+    """
+
+    @property
+    def has_prev(self):
+        return self.page < self.pages
+
+    @property
+    def prev_num(self):
+        return self.page + 1
+
+    @property
+    def has_next(self):
+        return self.page > 1
+
+    @property
+    def next_num(self):
+        return self.page - 1
+
+    def get_slice(self):
+        return Pagination.get_slice(self)[::-1]
+
+
+class EntryView(Sequence):
+    """A read only window on the blog index, slicing it copies nothing"""
+
+    def __init__(self, entries: List[FileContext], start: int, stop: int):
+        self._entries = entries
+        self._start = start
+        self._stop = stop
+
+    def __len__(self):
+        return self._stop - self._start
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            start, stop, step = idx.indices(len(self))
+            if step != 1:
+                return [self[x] for x in range(start, stop, step)]
+            return EntryView(self._entries, self._start + start,
+                             self._start + max(start, stop))
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(idx)
+        return self._entries[self._start + idx]
+
+    def __iter__(self):
+        return itertools.islice(self._entries, self._start, self._stop)
+
+
 class MonthArchive(object):
 
     def __init__(self, builder, year, month, entries):
@@ -101,7 +158,6 @@ class MonthArchive(object):
         self.year = year
         self.month = month
         self.entries = entries
-        entries.sort(key=lambda x: x.meta.pub_date, reverse=True)
 
     @property
     def month_name(self):
@@ -116,17 +172,55 @@ class MonthArchive(object):
 
 class YearArchive(object):
 
-    def __init__(self, builder, year, months):
+    def __init__(self, builder, year, entries, months):
         self.year = year
-        self.months = [MonthArchive(builder, year, month, entries)
-                       for month, entries in months.items()]
-        self.months.sort(key=lambda x: -int(x.month))
-        self.count = sum(len(x.entries) for x in self.months)
+        self.entries = entries
+        self.months = months
+        self.count = len(entries)
 
 
-def test_pattern(path, pattern):
+class BlogIndex:
+    """
+    All blog entries, sorted once per build newest first.  Years and
+    months are contiguous runs of it, exposed as `EntryView`.
+    """
+
+    def __init__(self, builder: Builder, entries: List[FileContext]):
+        entries.sort(key=lambda x: (x.meta.pub_date,
+                                    x.config.get('day-order', 0)),
+                     reverse=True)
+        self.entries = entries
+        self.years = []
+        year_start = month_start = 0
+        months = []
+        for idx, entry in enumerate(entries):
+            next_entry = entries[idx + 1] if idx + 1 < len(entries) else None
+            pub_date = entry.meta.pub_date
+            next_date = next_entry and next_entry.meta.pub_date
+            if next_date and (next_date.year, next_date.month) == \
+                    (pub_date.year, pub_date.month):
+                continue
+            months.append(MonthArchive(
+                builder, pub_date.year, ('0%d' % pub_date.month)[-2:],
+                EntryView(entries, month_start, idx + 1)))
+            month_start = idx + 1
+            if next_date and next_date.year == pub_date.year:
+                continue
+            self.years.append(YearArchive(
+                builder, pub_date.year,
+                EntryView(entries, year_start, idx + 1), months))
+            year_start = idx + 1
+            months = []
+
+
+@functools.lru_cache(maxsize=None)
+def _get_pattern_adapter(pattern):
     pattern = '/' + pattern.strip('/') + '/<path:extra>'
-    adapter = Map([Rule(pattern)]).bind('dummy.invalid')
+    return Map([Rule(pattern)]).bind('dummy.invalid')
+
+
+def test_pattern(path, pattern):
+    adapter = _get_pattern_adapter(pattern)
     try:
         endpoint, values = adapter.match(path.strip('/'))
     except NotFound:
@@ -145,32 +239,31 @@ def process_blog_entry(context: FileContext):
     if context.meta.type == 'page':
         context.builder.get_storage('blog.page')\
             .setdefault('page', []).append(context)
+        # the nav bar of every page lists them
+        context.builder.get_storage('layout')\
+            .setdefault('blog.pages', []).append(
+                [context.slug, context.meta.title])
     elif context.meta.pub_date is not None:
         context.builder.get_storage('blog') \
-            .setdefault(context.meta.pub_date.year, {}) \
-            .setdefault(('0%d' % context.meta.pub_date.month)[-2:], []) \
-            .append(context)
+            .setdefault('entries', []).append(context)
 
 
-def get_all_entries(builder: Builder) -> List[FileContext]:
-    """Returns all blog entries in reverse order"""
-    result = []
+def get_blog_index(builder: Builder) -> BlogIndex:
+    """Returns the blog index, built on first use in each build"""
     storage = builder.get_storage('blog')
-    years = storage.items()
-    for year, months in years:
-        for month, contexts in months.items():
-            result.extend(contexts)
-    result.sort(key=lambda x: (x.meta.pub_date, x.config.get('day-order', 0)),
-                reverse=True)
-    return result
+    if 'index' not in storage:
+        storage['index'] = BlogIndex(builder, storage.get('entries', []))
+    return storage['index']
+
+
+def get_all_entries(builder: Builder) -> List[FileContext]:
+    """Returns all blog entries in reverse order, do not modify it"""
+    return get_blog_index(builder).entries
 
 
 def get_archive_summary(builder):
     """Returns a summary of the stuff in the archives."""
-    storage = builder.get_storage('blog')
-    years = storage.items()
-    years = sorted(years, key=lambda x: -x[0])
-    return [YearArchive(builder, year, months) for year, months in years]
+    return get_blog_index(builder).years
 
 
 @contextfunction
@@ -182,76 +275,161 @@ def get_pages(builder: Builder) -> List[FileContext]:
     return builder.get_storage('blog.page').setdefault('page', [])
 
 
-def write_index_page(builder):
+def _get_entry_signature(entry: FileContext) -> list:
+    return [entry.slug, entry.meta.title, entry.meta.pub_date,
+            entry.meta.summary]
+
+
+def _write_pagination_page(builder, pagination, use_pagination,
+                           _url_key, **values):
+    builder.submit_link_file('blog/index.html', {
+        'pagination':       pagination,
+        'show_pagination':  use_pagination,
+    }, _url_key, signature=[
+        # not the number of pages, a stable page stays as it is when
+        # newer pages are added
+        type(pagination).__name__, pagination.page, pagination.has_prev,
+        pagination.has_next, pagination.pages > 1, use_pagination,
+        [_get_entry_signature(x) for x in pagination.get_slice()]
+    ], **values)
+
+
+def iter_index_pages(builder):
+    """
+    Yields (url key, page, pagination) of every index page, the way they
+    are written: with stable pagination the front page shows the newest
+    page, which is also written to `blog_page` with all older ones.
+    """
     use_pagination = builder.config.root_get('modules.blog.use_pagination', True)
     per_page = builder.config.root_get('modules.blog.per_page', 10)
     entries = get_all_entries(builder)
-    pagination = Pagination(builder, entries, 1, per_page, 'blog_index')
-    while 1:
-        with builder.open_link_file('blog_index', page=pagination.page) as f:
-            rv = builder.render_template('blog/index.html', {
-                'pagination':       pagination,
-                'show_pagination':  use_pagination,
-            })
-            f.write(rv + '\n')
-            if not use_pagination or not pagination.has_next:
+    if use_pagination and builder.config.root_get(
+            'modules.blog.stable_pagination', False):
+        pagination = StablePagination(builder, entries[::-1], 1, per_page,
+                                      'blog_page')
+        pagination.page = max(pagination.pages, 1)
+        yield 'blog_index', 1, pagination
+        while 1:
+            yield 'blog_page', pagination.page, pagination
+            if not pagination.has_next:
                 break
             pagination = pagination.get_next()
+        return
+    pagination = Pagination(builder, entries, 1, per_page, 'blog_index')
+    while 1:
+        yield 'blog_index', pagination.page, pagination
+        if not use_pagination or not pagination.has_next:
+            break
+        pagination = pagination.get_next()
+
+
+def write_index_page(builder):
+    use_pagination = builder.config.root_get('modules.blog.use_pagination', True)
+    for key, page, pagination in iter_index_pages(builder):
+        _write_pagination_page(builder, pagination, use_pagination, key,
+                               page=page)
+
+
+def produce_index_page(builder, page=1):
+    """Writes a single index page, for the lazy dev server"""
+    page = int(page)
+    use_pagination = builder.config.root_get('modules.blog.use_pagination', True)
+    per_page = builder.config.root_get('modules.blog.per_page', 10)
+    entries = get_all_entries(builder)
+    if use_pagination and builder.config.root_get(
+            'modules.blog.stable_pagination', False):
+        if page != 1:
+            return produce_stable_page(builder, page)
+        pagination = StablePagination(builder, entries[::-1], 1, per_page,
+                                      'blog_page')
+        pagination.page = max(pagination.pages, 1)
+    else:
+        pagination = Pagination(builder, entries, page, per_page,
+                                'blog_index')
+        if page < 1 or page > max(pagination.pages, 1) or (
+                page > 1 and not use_pagination):
+            return False
+    _write_pagination_page(builder, pagination, use_pagination,
+                           'blog_index', page=page)
+    return True
+
+
+def produce_stable_page(builder, page):
+    page = int(page)
+    per_page = builder.config.root_get('modules.blog.per_page', 10)
+    entries = get_all_entries(builder)[::-1]
+    pagination = StablePagination(builder, entries, page, per_page,
+                                  'blog_page')
+    if page < 1 or page > max(pagination.pages, 1):
+        return False
+    _write_pagination_page(builder, pagination, True, 'blog_page', page=page)
+    return True
+
+
+def _write_archive_index(builder, archive):
+    builder.submit_link_file('blog/archive.html', {
+        'archive':      archive
+    }, 'blog_archive', signature=[
+        [entry.year, [[x.month, x.count] for x in entry.months]]
+        for entry in archive
+    ])
+
+
+def _write_year_archive(builder, entry):
+    builder.submit_link_file('blog/year_archive.html', {
+        'entry':    entry
+    }, 'blog_archive', year=entry.year, signature=[
+        [x.month, x.count] for x in entry.months
+    ])
+
+
+def _write_month_archive(builder, entry, subentry):
+    builder.submit_link_file('blog/month_archive.html', {
+        'entry':    subentry
+    }, 'blog_archive', year=entry.year, month=subentry.month,
+        signature=[_get_entry_signature(x) for x in subentry.entries])
 
 
 def write_archive_pages(builder):
     archive = get_archive_summary(builder)
-    with builder.open_link_file('blog_archive') as f:
-        rv = builder.render_template('blog/archive.html', {
-            'archive':      archive
-        })
-        f.write(rv + '\n')
+    _write_archive_index(builder, archive)
+    for entry in archive:
+        _write_year_archive(builder, entry)
+        for subentry in entry.months:
+            _write_month_archive(builder, entry, subentry)
 
+
+def produce_archive_page(builder, year=None, month=None):
+    """Writes a single archive page, for the lazy dev server"""
+    archive = get_archive_summary(builder)
+    if year is None:
+        _write_archive_index(builder, archive)
+        return True
     for entry in archive:
-        with builder.open_link_file('blog_archive', year=entry.year) as f:
-            rv = builder.render_template('blog/year_archive.html', {
-                'entry':    entry
-            })
-            f.write(rv + '\n')
+        if str(entry.year) != str(year):
+            continue
+        if month is None:
+            _write_year_archive(builder, entry)
+            return True
         for subentry in entry.months:
-            with builder.open_link_file('blog_archive', year=entry.year,
-                                        month=subentry.month) as f:
-                rv = builder.render_template('blog/month_archive.html', {
-                    'entry':    subentry
-                })
-                f.write(rv + '\n')
-
-
-# def write_feed(builder):
-#     blog_author = builder.config.root_get('author')
-#     url = builder.config.root_get('canonical_url') or 'http://localhost/'
-#     name = builder.config.get('feed.name') or u'Recent Blog Posts'
-#     subtitle = builder.config.get('feed.subtitle') or u'Recent blog posts'
-#     feed = AtomFeed(name,
-#                     subtitle=subtitle,
-#                     feed_url=urljoin(url, builder.link_to('blog_feed')),
-#                     url=url)
-#     for entry in get_all_entries(builder)[:10]:
-#         feed.add(entry.meta.title, str(entry.content),
-#                  content_type='html', author=blog_author,
-#                  url=urljoin(url, entry.slug),
-#                  updated=entry.meta.pub_date)
-#     with builder.open_link_file('blog_feed') as f:
-#         f.write(feed.to_string() + '\n')
+            if str(subentry.month) == str(month):
+                _write_month_archive(builder, entry, subentry)
+                return True
+    return False
 
 
 def write_blog_files(builder):
     write_index_page(builder)
     write_archive_pages(builder)
-    # write_feed(builder)
 
 
 def copy_builtin_static_files(builder: Builder) -> None:
 
     dest_static_folder = builder.static_folder
-    if os.path.exists(dest_static_folder):
-        shutil.rmtree(dest_static_folder)
-    shutil.copytree(builtin_static, dest_static_folder)
+    for filename in os.listdir(builtin_static):
+        source = os.path.join(builtin_static, filename)
+        builder.writer.copy(source, os.path.join(dest_static_folder, filename))
+        builder.assets.add(filename, source=source)
 
 
 @contextfunction
@@ -269,6 +447,10 @@ def setup(builder):
                          config_default='/', defaults={'page': 1})
     builder.register_url('blog_index', config_key='modules.blog.paged_index_url',
                          config_default='/page/<page>/')
+    if builder.config.root_get('modules.blog.stable_pagination', False):
+        builder.register_url('blog_page',
+                             config_key='modules.blog.stable_page_url',
+                             config_default='/page/<int:page>/')
     builder.register_url('blog_archive', config_key='modules.blog.archive_url',
                          config_default='/archive/')
     builder.register_url('blog_archive',
@@ -279,6 +461,9 @@ def setup(builder):
                          config_default='/<year>/<month>/')
     builder.register_url('blog_feed', config_key='modules.blog.feed_url',
                          config_default='/feed.atom')
+    builder.register_producer('blog_index', produce_index_page)
+    builder.register_producer('blog_page', produce_stable_page)
+    builder.register_producer('blog_archive', produce_archive_page)
     builder.update_jinja_env(
         get_recent_blog_entries=get_recent_blog_entries,
         get_pages=functools.partial(get_pages, builder),
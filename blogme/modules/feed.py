@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+
+from datetime import datetime
+from email.utils import format_datetime
+from urllib.parse import urljoin
+from xml.sax.saxutils import escape, quoteattr
+from typing import List
+
+from blogme.signals import before_build_finished
+from blogme.builder import Builder, FileContext
+from blogme.output import file_digest
+from blogme.modules import blog
+
+
+def get_feed_entries(builder: Builder, limit: int) -> List[FileContext]:
+    """Returns the newest `limit` blog entries, newest first"""
+    return blog.get_all_entries(builder)[:limit]
+
+
+def _atom_date(d: datetime) -> str:
+    return d.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def _entry_text(context: FileContext, mode: str) -> str:
+    if mode == 'summary':
+        return context.meta.summary or ''
+    return str(context.content)
+
+
+class FeedInfo:
+
+    def __init__(self, builder: Builder, key: str):
+        config = builder.config
+        self.url = config.root_get('canonical_url') or 'http://localhost/'
+        self.feed_url = urljoin(self.url, builder.link_to(key))
+        self.title = config.root_get('feed.name') or 'Recent Blog Posts'
+        self.subtitle = config.root_get('feed.subtitle') or 'Recent blog posts'
+        self.author = config.root_get('author')
+        self.mode = config.root_get('modules.feed.mode', 'full')
+        self.builder = builder
+
+    def entry_url(self, context: FileContext) -> str:
+        return urljoin(self.url, self.builder.link_to('post',
+                                                      slug=context.slug))
+
+
+def write_atom(f, info: FeedInfo, entries: List[FileContext]) -> None:
+    updated = entries[0].meta.pub_date if entries else datetime.utcnow()
+    f.write('<?xml version="1.0" encoding="utf-8"?>\n')
+    f.write('<feed xmlns="http://www.w3.org/2005/Atom">\n')
+    f.write(f'<title>{escape(info.title)}</title>\n')
+    f.write(f'<subtitle>{escape(info.subtitle)}</subtitle>\n')
+    f.write(f'<id>{escape(info.feed_url)}</id>\n')
+    f.write(f'<updated>{_atom_date(updated)}</updated>\n')
+    f.write(f'<link href={quoteattr(info.url)}/>\n')
+    f.write(f'<link href={quoteattr(info.feed_url)} rel="self"/>\n')
+    if info.author:
+        f.write(f'<author><name>{escape(info.author)}</name></author>\n')
+    tag = 'summary' if info.mode == 'summary' else 'content'
+    for entry in entries:
+        url = info.entry_url(entry)
+        f.write('<entry>\n')
+        f.write(f'<title>{escape(entry.meta.title)}</title>\n')
+        f.write(f'<id>{escape(url)}</id>\n')
+        f.write(f'<link href={quoteattr(url)}/>\n')
+        f.write(f'<updated>{_atom_date(entry.meta.pub_date)}</updated>\n')
+        f.write(f'<published>{_atom_date(entry.meta.pub_date)}</published>\n')
+        f.write(f'<{tag} type="html">'
+                f'{escape(_entry_text(entry, info.mode))}</{tag}>\n')
+        f.write('</entry>\n')
+    f.write('</feed>\n')
+
+
+def write_rss(f, info: FeedInfo, entries: List[FileContext]) -> None:
+    f.write('<?xml version="1.0" encoding="utf-8"?>\n')
+    f.write('<rss version="2.0"><channel>\n')
+    f.write(f'<title>{escape(info.title)}</title>\n')
+    f.write(f'<link>{escape(info.url)}</link>\n')
+    f.write(f'<description>{escape(info.subtitle)}</description>\n')
+    for entry in entries:
+        url = info.entry_url(entry)
+        f.write('<item>\n')
+        f.write(f'<title>{escape(entry.meta.title)}</title>\n')
+        f.write(f'<link>{escape(url)}</link>\n')
+        f.write(f'<guid>{escape(url)}</guid>\n')
+        f.write(f'<pubDate>{format_datetime(entry.meta.pub_date)}</pubDate>\n')
+        f.write(f'<description>{escape(_entry_text(entry, info.mode))}'
+                f'</description>\n')
+        f.write('</item>\n')
+    f.write('</channel></rss>\n')
+
+
+def _get_signature(builder: Builder, entries: List[FileContext]) -> list:
+    config = builder.config
+    # the urls end up in <id> and <link>
+    signature = [config.root_get('modules.feed.mode', 'full'),
+                 config.root_get('feed.name'),
+                 config.root_get('feed.subtitle'),
+                 config.root_get('author'),
+                 config.root_get('canonical_url'),
+                 builder.link_to('blog_feed')]
+    if builder.has_url('blog_feed_rss'):
+        signature.append(builder.link_to('blog_feed_rss'))
+    for entry in entries:
+        signature.append([entry.slug, builder.link_to('post', slug=entry.slug),
+                          entry.meta.title,
+                          _atom_date(entry.meta.pub_date),
+                          entry.meta.summary,
+                          file_digest(entry.full_source_filename)])
+    return signature
+
+
+def _write_feed(builder: Builder, key: str, write, entries, changed):
+    filename = builder.get_link_filename(key)
+    # a missing file is written even if nothing changed
+    if not changed and builder.writer.keep(filename):
+        return
+    with builder.open_link_file(key) as f:
+        write(f, FeedInfo(builder, key), entries)
+
+
+def write_feeds(builder: Builder) -> None:
+    limit = builder.config.root_get('modules.feed.limit', 10)
+    entries = get_feed_entries(builder, limit)
+    cache = builder.get_cache('feed')
+    signature = _get_signature(builder, entries)
+    changed = cache.get('signature') != signature
+    _write_feed(builder, 'blog_feed', write_atom, entries, changed)
+    if builder.config.root_get('modules.feed.rss_url'):
+        _write_feed(builder, 'blog_feed_rss', write_rss, entries, changed)
+    cache['signature'] = signature
+
+
+def setup(builder: Builder):
+    before_build_finished.connect(write_feeds)
+    rss_url = builder.config.root_get('modules.feed.rss_url')
+    if rss_url:
+        builder.register_url('blog_feed_rss', rss_url)
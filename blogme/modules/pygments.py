@@ -1,52 +1,84 @@
 # -*- coding: utf-8 -*-
+"""
+code highlighting for rst files.  pygments is imported on the first
+highlighted block, the stylesheet is kept in the build cache.
+"""
+
+from functools import lru_cache
 
 from blogme.signals import (
+    before_build,
     before_file_processed,
     before_build_finished
 )
+from blogme.builder import Builder, FileContext
+from blogme.file_parser import rst_directives
 
-from docutils import nodes
-from docutils.parsers.rst import Directive, directives
-from pygments import highlight
-from pygments.lexers import get_lexer_by_name, TextLexer
-from pygments.formatters import HtmlFormatter
-from pygments.styles import get_style_by_name
+style_name = None
+
+
+@lru_cache(maxsize=None)
+def get_html_formatter():
+    from pygments.formatters import HtmlFormatter
+    from pygments.styles import get_style_by_name
+    return HtmlFormatter(style=get_style_by_name(style_name))
 
-from blogme.builder import Builder, FileContext
 
-html_formatter = None
+@lru_cache(maxsize=None)
+def get_code_block_directive() -> type:
+    from docutils import nodes
+    from docutils.parsers.rst import Directive
+    from pygments import highlight
+    from pygments.lexers import get_lexer_by_name, TextLexer
 
+    class CodeBlock(Directive):
+        has_content = True
+        required_arguments = 1
+        optional_arguments = 0
+        final_argument_whitespace = False
 
-class CodeBlock(Directive):
-    has_content = True
-    required_arguments = 1
-    optional_arguments = 0
-    final_argument_whitespace = False
+        def run(self):
+            try:
+                lexer = get_lexer_by_name(self.arguments[0])
+            except ValueError:
+                lexer = TextLexer()
+            code = u'\n'.join(self.content)
+            formatted = highlight(code, lexer, get_html_formatter())
+            return [nodes.raw('', formatted, format='html')]
 
-    def run(self):
-        try:
-            lexer = get_lexer_by_name(self.arguments[0])
-        except ValueError:
-            lexer = TextLexer()
-        code = u'\n'.join(self.content)
-        formatted = highlight(code, lexer, html_formatter)
-        return [nodes.raw('', formatted, format='html')]
+    return CodeBlock
+
+
+def get_style_defs(builder: Builder) -> str:
+    # the package itself is tiny, formatters and styles are not
+    import pygments
+    cache = builder.get_cache('pygments')
+    key = [style_name, pygments.__version__]
+    if cache.get('key') != key:
+        cache['key'] = key
+        cache['css'] = get_html_formatter().get_style_defs()
+    return cache['css']
 
 
 def inject_stylesheet(context: FileContext, **kwargs):
     context.add_stylesheet('pygments.css')
 
 
+def register_stylesheet(builder: Builder, **kwargs):
+    builder.assets.add('pygments.css', data=get_style_defs(builder))
+
+
 def write_stylesheet(builder: Builder, **kwargs):
     with builder.open_link_file('static', filename='pygments.css') as f:
-        f.write(html_formatter.get_style_defs())
+        f.write(get_style_defs(builder))
 
 
 def setup(builder: Builder):
-    global html_formatter
-    style = get_style_by_name(builder.config.root_get('modules.pygments.style'))
-    html_formatter = HtmlFormatter(style=style)
-    directives.register_directive('code-block', CodeBlock)
-    directives.register_directive('sourcecode', CodeBlock)
+    global style_name
+    style_name = builder.config.root_get('modules.pygments.style')
+    get_html_formatter.cache_clear()
+    rst_directives['code-block'] = get_code_block_directive
+    rst_directives['sourcecode'] = get_code_block_directive
+    before_build.connect(register_stylesheet)
     before_file_processed.connect(inject_stylesheet)
     before_build_finished.connect(write_stylesheet)
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+prebuilt client side search index
+
+the index is written as json shards below `/search/`:
+
+    docs.json       {"docs": {id: [url, title]}, "shards": [key, ...]}
+    <key>.json      {term: [[id, score], ...]}
+
+a term belongs to the shard `shard_key(term)`, clients tokenize the query
+the same way as `tokenize` and fetch only the shards of its terms.
+"""
+
+import re
+import os
+import json
+from html import unescape
+from collections import Counter
+from typing import Iterator, Dict
+
+from blogme.signals import (
+    after_file_published,
+    before_build_finished
+)
+from blogme.builder import Builder, FileContext
+
+
+_cjk_ranges = (
+    '぀-ヿ'     # hiragana, katakana
+    '㐀-䶿'     # cjk extension a
+    '一-鿿'     # cjk unified ideographs
+    '가-힯'     # hangul syllables
+    '豈-﫿'     # cjk compatibility ideographs
+)
+_token_re = re.compile(rf'([{_cjk_ranges}]+)|([^\W_{_cjk_ranges}]+)')
+_tag_re = re.compile(r'<[^>]*>')
+
+#: number of shards for non ascii terms
+shard_buckets = 64
+
+field_weights = (('title', 3), ('tags', 2), ('summary', 1), ('body', 1))
+
+
+def tokenize(text: str) -> Iterator[str]:
+    """
+    Latin words are lower cased, runs of CJK characters are split into
+    overlapping bigrams (a single character stays a unigram).
+    """
+    for match in _token_re.finditer(text or ''):
+        cjk, word = match.groups()
+        if word:
+            yield word.lower()
+        elif len(cjk) == 1:
+            yield cjk
+        else:
+            for idx in range(len(cjk) - 1):
+                yield cjk[idx:idx + 2]
+
+
+def shard_key(term: str) -> str:
+    c = term[0]
+    if c.isascii() and c.isalnum():
+        return c
+    return '%02x' % (ord(c) % shard_buckets)
+
+
+def html_to_text(html: str) -> str:
+    return unescape(_tag_re.sub(' ', html))
+
+
+def remember_post(context: FileContext):
+    # copied html files have no title or content to index
+    if context.is_template:
+        context.builder.get_storage('search')\
+            .setdefault('posts', []).append(context)
+
+
+def _get_signature(context: FileContext) -> list:
+    st = os.stat(context.full_source_filename)
+    return [st.st_size, st.st_mtime_ns, context.meta.title,
+            context.meta.summary, sorted(getattr(context, 'tags', ()))]
+
+
+def index_post(context: FileContext) -> Dict[str, int]:
+    fields = {
+        'title': context.meta.title,
+        'tags': ' '.join(getattr(context, 'tags', ())),
+        'summary': context.meta.summary or '',
+        'body': html_to_text(str(context.content)),
+    }
+    terms = Counter()
+    for field, weight in field_weights:
+        for term in tokenize(fields[field]):
+            terms[term] += weight
+    return dict(terms)
+
+
+def write_search_index(builder: Builder):
+    cache = builder.get_cache('search')
+    ids = cache.setdefault('ids', {})
+    indexed = cache.setdefault('posts', {})
+    next_id = cache.get('next_id', 0)
+
+    posts = builder.get_storage('search').get('posts', [])
+    live = set()
+    docs = {}
+    dirty = set()
+    for context in posts:
+        source = context.source_filename
+        live.add(source)
+        if source not in ids:
+            ids[source] = next_id
+            next_id += 1
+        # the front matter may move a page away from its slug
+        url = builder.link_to(
+            'post', slug=context.destination_filename.replace('\\', '/'))
+        docs[ids[source]] = [url, context.meta.title]
+        signature = _get_signature(context)
+        old = indexed.get(source)
+        if old is not None and old['signature'] == signature:
+            continue
+        terms = index_post(context)
+        if old is not None:
+            dirty.update(shard_key(x) for x in old['terms'])
+        dirty.update(shard_key(x) for x in terms)
+        indexed[source] = {'signature': signature, 'terms': terms}
+    for source in list(indexed):
+        if source not in live:
+            dirty.update(shard_key(x) for x in indexed.pop(source)['terms'])
+            del ids[source]
+    cache['next_id'] = next_id
+
+    shards = {}
+    for source, post in indexed.items():
+        doc = ids[source]
+        for term, score in post['terms'].items():
+            shards.setdefault(shard_key(term), {})\
+                .setdefault(term, []).append([doc, score])
+
+    for key in sorted(set(shards) | dirty):
+        filename = builder.get_link_filename('search_index', shard=key)
+        if key not in dirty and builder.writer.keep(filename):
+            continue
+        if key not in shards:
+            # emptied shard, it is removed as a stale output
+            continue
+        shard = shards[key]
+        for postings in shard.values():
+            postings.sort(key=lambda x: (-x[1], x[0]))
+        with builder.open_link_file('search_index', shard=key) as f:
+            json.dump(shard, f, ensure_ascii=False, sort_keys=True,
+                      separators=(',', ':'))
+
+    with builder.open_link_file('search_index', shard='docs') as f:
+        json.dump({'docs': docs, 'shards': sorted(shards)}, f,
+                  ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+
+
+def setup(builder: Builder):
+    after_file_published.connect(remember_post)
+    before_build_finished.connect(write_search_index)
+    builder.register_url('search_index', config_key='modules.search.url',
+                         config_default='/search/<shard>.json')
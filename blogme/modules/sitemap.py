@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+
+import os
+import hashlib
+from datetime import datetime, date
+from urllib.parse import urljoin
+from xml.sax.saxutils import escape
+from typing import Iterator, List, Optional, Tuple
+
+from blogme.signals import (
+    after_file_published,
+    before_build_finished
+)
+from blogme.builder import Builder, FileContext
+from blogme.modules import blog, tags
+
+
+#: limits of the sitemap protocol
+max_urls = 50000
+max_bytes = 50 * 1024 * 1024 - 1024
+
+header = ('<?xml version="1.0" encoding="utf-8"?>\n'
+          '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n')
+footer = '</urlset>\n'
+index_header = ('<?xml version="1.0" encoding="utf-8"?>\n'
+                '<sitemapindex '
+                'xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n')
+index_footer = '</sitemapindex>\n'
+
+Url = Tuple[str, Optional[str]]
+
+
+def remember_page(context: FileContext):
+    if not context.destination_filename.endswith('.html'):
+        return
+    storage = context.builder.get_storage('sitemap')
+    storage.setdefault('pages', []).append(context)
+    mtime = os.path.getmtime(context.full_source_filename)
+    storage.setdefault('lastmod', {})[context.source_filename] = \
+        date.fromtimestamp(mtime).isoformat()
+
+
+def _lastmod(builder: Builder, contexts) -> Optional[str]:
+    lastmod = builder.get_storage('sitemap').get('lastmod', {})
+    return max((lastmod.get(x.source_filename) for x in contexts
+                if x.source_filename in lastmod), default=None)
+
+
+def iter_post_urls(builder: Builder) -> Iterator[Url]:
+    """Posts and pages, oldest first so new posts end up in the last shard"""
+    pages = builder.get_storage('sitemap').get('pages', [])
+    pages = sorted(pages, key=lambda x: (x.meta.pub_date or datetime.min,
+                                         x.slug))
+    for context in pages:
+        yield (builder.link_to('post', slug=context.slug),
+               _lastmod(builder, [context]))
+
+
+def iter_listing_urls(builder: Builder) -> Iterator[Url]:
+    """Index, archive and tag pages of the active modules"""
+    entries = blog.get_all_entries(builder)
+    if builder.has_url('blog_index'):
+        for key, page, pagination in blog.iter_index_pages(builder):
+            yield (builder.link_to(key, page=page),
+                   _lastmod(builder, pagination.get_slice()))
+    if builder.has_url('blog_archive'):
+        yield builder.link_to('blog_archive'), _lastmod(builder, entries)
+        for year in reversed(blog.get_archive_summary(builder)):
+            yield (builder.link_to('blog_archive', year=year.year),
+                   _lastmod(builder, year.entries))
+            for month in reversed(year.months):
+                yield (builder.link_to('blog_archive', year=year.year,
+                                       month=month.month),
+                       _lastmod(builder, month.entries))
+    if builder.has_url('tagcloud'):
+        yield builder.link_to('tagcloud'), None
+    if builder.has_url('tag'):
+        by_tag = builder.get_storage('tags').get('by_tag', {})
+        for tag in sorted(by_tag):
+            yield (builder.link_to('tag', tag=tag),
+                   _lastmod(builder, tags.get_tagged_entries(builder, tag)))
+
+
+def _url_line(base: str, url: Url, tag: str = 'url') -> str:
+    link, lastmod = url
+    rv = f'<{tag}><loc>{escape(urljoin(base, link))}</loc>'
+    if lastmod:
+        rv += f'<lastmod>{lastmod}</lastmod>'
+    return rv + f'</{tag}>\n'
+
+
+def iter_shards(lines: Iterator[Tuple[str, Optional[str]]],
+                urls_per_shard: int) -> Iterator[list]:
+    shard, size = [], len(header) + len(footer)
+    for line, lastmod in lines:
+        line_size = len(line.encode('utf-8'))
+        if shard and (len(shard) >= urls_per_shard or
+                      size + line_size > max_bytes):
+            yield shard
+            shard, size = [], len(header) + len(footer)
+        shard.append((line, lastmod))
+        size += line_size
+    if shard:
+        yield shard
+
+
+def _write_if_changed(builder: Builder, old_digest: Optional[str],
+                      lines: List[str], _url_key: str, **values) -> str:
+    digest = hashlib.sha1(''.join(lines).encode('utf-8')).hexdigest()
+    filename = builder.get_link_filename(_url_key, **values)
+    if old_digest == digest and builder.writer.keep(filename):
+        return digest
+    with builder.open_link_file(_url_key, **values) as f:
+        for line in lines:
+            f.write(line)
+    return digest
+
+
+def write_sitemaps(builder: Builder) -> None:
+    base = builder.config.root_get('canonical_url') or 'http://localhost/'
+    urls_per_shard = min(max_urls, builder.config.root_get(
+        'modules.sitemap.urls_per_shard', max_urls))
+    cache = builder.get_cache('sitemap')
+    old_cache = dict(cache)
+    cache.clear()
+
+    shards = []
+    # posts and listing pages are sharded separately, so a new post or
+    # tag only touches the last shard of its kind
+    for urls in (iter_post_urls(builder), iter_listing_urls(builder)):
+        lines = ((_url_line(base, url), url[1]) for url in urls)
+        shards.extend(iter_shards(lines, urls_per_shard))
+
+    index = []
+    for shard_no, shard in enumerate(shards, 1):
+        lines = [header] + [line for line, lastmod in shard] + [footer]
+        key = str(shard_no)
+        cache[key] = _write_if_changed(builder, old_cache.get(key), lines,
+                                       'sitemap', shard=shard_no)
+        lastmod = max((x for _, x in shard if x), default=None)
+        index.append((builder.link_to('sitemap', shard=shard_no), lastmod))
+
+    lines = [index_header] + [_url_line(base, url, 'sitemap')
+                              for url in index] + [index_footer]
+    cache['index'] = _write_if_changed(builder, old_cache.get('index'),
+                                       lines, 'sitemap_index')
+
+
+def setup(builder: Builder):
+    after_file_published.connect(remember_page)
+    before_build_finished.connect(write_sitemaps)
+    builder.register_url('sitemap_index',
+                         config_key='modules.sitemap.index_url',
+                         config_default='/sitemap.xml')
+    builder.register_url('sitemap', config_key='modules.sitemap.shard_url',
+                         config_default='/sitemap-<int:shard>.xml')
@@ -1,13 +1,18 @@
 # -*- coding: utf-8 -*-
 
 import math
+import json
+import hashlib
+from collections import defaultdict
 
 from jinja2 import contextfunction
 
 
 from blogme.signals import (
     after_file_published,
-    before_build_finished
+    before_build_finished,
+    before_file_processed,
+    before_file_built
 )
 
 
@@ -21,30 +26,38 @@ class Tag(object):
 
 @contextfunction
 def get_tags(context, limit=50):
-    tags = get_tag_summary(context['builder'])
-    if limit:
-        tags.sort(key=lambda x: -x.count)
-        tags = tags[:limit]
-    tags.sort(key=lambda x: x.name.lower())
-    return tags
+    storage = context['builder'].get_storage('tags')
+    by_limit = storage.setdefault('by_limit', {})
+    if limit not in by_limit:
+        tags = get_tag_summary(context['builder'])
+        if limit:
+            tags = sorted(tags, key=lambda x: -x.count)[:limit]
+        by_limit[limit] = tuple(sorted(tags, key=lambda x: x.name.lower()))
+    return by_limit[limit]
 
 
 def get_tag_summary(builder):
+    """Returns all tags by ascending count, computed once per build"""
     storage = builder.get_storage('tags')
-    by_tag = storage.get('by_tag', {})
-    result = []
-    for tag, tagged in by_tag.items():
-        result.append(Tag(tag, len(tagged)))
-    result.sort(key=lambda x: x.count)
-    return result
+    if 'summary' not in storage:
+        by_tag = storage.get('by_tag', {})
+        result = [Tag(tag, len(tagged)) for tag, tagged in by_tag.items()]
+        result.sort(key=lambda x: x.count)
+        storage['summary'] = tuple(result)
+    return storage['summary']
 
 
 def get_tagged_entries(builder, tag):
+    """Returns the entries of a tag sorted by title, as a shared tuple"""
     if isinstance(tag, Tag):
         tag = tag.name
     storage = builder.get_storage('tags')
-    by_tag = storage.get('by_tag', {})
-    return by_tag.get(tag) or []
+    by_title = storage.setdefault('by_title', {})
+    if tag not in by_title:
+        tagged = storage.get('by_tag', {}).get(tag) or ()
+        by_title[tag] = tuple(sorted(
+            tagged, key=lambda x: (x.meta.title or '').lower()))
+    return by_title[tag]
 
 
 def remember_tags(context):
@@ -55,24 +68,148 @@ def remember_tags(context):
     by_tag = storage.setdefault('by_tag', {})
     for tag in tags:
         by_tag.setdefault(tag, []).append(context)
+    storage.setdefault('by_source', {})[context.source_filename] = context
     context.tags = frozenset(tags)
 
 
+def _tag_weight(count):
+    # adamic-adar: sharing a rare tag says more than sharing a common one
+    return 1 / math.log(1 + count)
+
+
+def _compute_related(builder, source, tags, limit):
+    by_tag = builder.get_storage('tags').get('by_tag', {})
+    max_tag_size = builder.config.root_get(
+        'modules.tags.related_max_tag_size', 1000)
+    scores = defaultdict(float)
+    for tag in tags:
+        tagged = by_tag.get(tag) or []
+        if len(tagged) > max_tag_size:
+            continue
+        weight = _tag_weight(len(tagged))
+        for other in tagged:
+            scores[other.source_filename] += weight
+    scores.pop(source, None)
+    ranked = sorted(scores.items(), key=lambda x: (-x[1], x[0]))
+    return [other for other, score in ranked[:limit]]
+
+
+def _get_related_index(builder):
+    """
+    related sources of every tagged post, computed once per build.  a post
+    is only re-scored if the membership of one of its tags changed.
+    """
+    storage = builder.get_storage('tags')
+    if 'related' in storage:
+        return storage['related']
+    limit = builder.config.root_get('modules.tags.related_limit', 10)
+    by_tag = storage.get('by_tag', {})
+    tag_signatures = {}
+    for tag, tagged in by_tag.items():
+        members = '\0'.join(sorted(x.source_filename for x in tagged))
+        tag_signatures[tag] = hashlib.sha1(members.encode('utf-8'))\
+            .hexdigest()
+
+    max_tag_size = builder.config.root_get(
+        'modules.tags.related_max_tag_size', 1000)
+    cache = builder.get_cache('tags.related')
+    old = dict(cache)
+    cache.clear()
+    related = {}
+    for source, tags in storage.get('by_file', {}).items():
+        tags = sorted(set(tags))
+        signature = [limit, max_tag_size] + [[tag, tag_signatures[tag]]
+                                             for tag in tags]
+        entry = old.get(source)
+        if entry is None or entry['signature'] != signature:
+            entry = {
+                'signature': signature,
+                'related': _compute_related(builder, source, tags, limit)
+            }
+        cache[source] = entry
+        related[source] = entry['related']
+    storage['related'] = related
+    return related
+
+
+def _find_related(builder, context, limit):
+    source = context.source_filename
+    related = _get_related_index(builder).get(source) or []
+    # the index keeps `related_limit` posts, more are scored on demand
+    if limit > builder.config.root_get('modules.tags.related_limit', 10):
+        tags = sorted(getattr(context, 'tags', ()))
+        related = _compute_related(builder, source, tags, limit)
+    by_source = builder.get_storage('tags').get('by_source', {})
+    return [by_source[x] for x in related[:limit] if x in by_source]
+
+
+def _related_digest(entries):
+    data = json.dumps([[x.slug, x.meta.title] for x in entries])
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+
+def get_related(builder, context, limit=5):
+    """
+    Returns up to `limit` posts sharing the most (and rarest) tags.  The
+    page of `context` is built again once they change.
+    """
+    rv = _find_related(builder, context, limit)
+    shown = builder.get_cache('tags.related_pages')
+    shown.setdefault(context.source_filename, {})[str(limit)] = \
+        _related_digest(rv)
+    return rv
+
+
+def forget_related(context):
+    # the page records what it shows again while it is rendered
+    context.builder.get_cache('tags.related_pages')\
+        .pop(context.source_filename, None)
+
+
+def check_related(context):
+    builder = context.builder
+    shown = builder.get_cache('tags.related_pages')\
+        .get(context.source_filename)
+    for limit, digest in (shown or {}).items():
+        if _related_digest(_find_related(builder, context,
+                                         int(limit))) != digest:
+            context.invalidate()
+            return
+
+
+@contextfunction
+def _get_related(context, ctx, limit=5):
+    return get_related(context['builder'], ctx, limit)
+
+
 def write_tagcloud_page(builder):
-    with builder.open_link_file('tagcloud') as f:
-        rv = builder.render_template('tagcloud.html')
-        f.write(rv + '\n')
+    builder.submit_link_file('tagcloud.html', {}, 'tagcloud', signature=[
+        [tag.name, tag.count] for tag in get_tag_summary(builder)
+    ])
 
 
 def write_tag_page(builder, tag):
     entries = get_tagged_entries(builder, tag)
-    entries.sort(key=lambda x: (x.meta.title or '').lower())
-    with builder.open_link_file('tag', tag=tag.name) as f:
-        rv = builder.render_template('tag.html', {
-            'tag':      tag,
-            'entries':  entries
-        })
-        f.write(rv + '\n')
+    builder.submit_link_file('tag.html', {
+        'tag':      tag,
+        'entries':  entries
+    }, 'tag', tag=tag.name, signature=[
+        [x.slug, x.meta.title, x.meta.pub_date] for x in entries
+    ])
+
+
+def produce_tag_page(builder, tag):
+    """Writes a single tag page, for the lazy dev server"""
+    for item in get_tag_summary(builder):
+        if item.name == tag:
+            write_tag_page(builder, item)
+            return True
+    return False
+
+
+def produce_tagcloud_page(builder):
+    write_tagcloud_page(builder)
+    return True
 
 
 def write_tag_files(builder):
@@ -83,9 +220,13 @@ def write_tag_files(builder):
 
 def setup(builder):
     after_file_published.connect(remember_tags)
+    before_file_processed.connect(check_related)
+    before_file_built.connect(forget_related)
     before_build_finished.connect(write_tag_files)
     builder.register_url('tag', config_key='modules.tags.tag_url',
                          config_default='/tags/<tag>/')
     builder.register_url('tagcloud', config_key='modules.tags.cloud_url',
                          config_default='/tags/')
-    builder.update_jinja_env(get_tags=get_tags)
+    builder.register_producer('tag', produce_tag_page)
+    builder.register_producer('tagcloud', produce_tagcloud_page)
+    builder.update_jinja_env(get_tags=get_tags, get_related=_get_related)
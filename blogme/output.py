@@ -0,0 +1,568 @@
+# -*- coding: utf-8 -*-
+"""
+write build outputs only when their content changed
+"""
+
+import io
+import os
+import json
+import time
+import shutil
+import tarfile
+import zipfile
+import hashlib
+import tempfile
+import threading
+from typing import TYPE_CHECKING, Dict, Union, Optional, List
+
+
+if TYPE_CHECKING:
+    from blogme.builder import Builder
+
+
+_umask = os.umask(0)
+os.umask(_umask)
+_file_mode = 0o666 & ~_umask
+
+_chunk_size = 1024 * 64
+
+
+def _atomic_replace(filename: str, fill) -> None:
+    folder = os.path.dirname(filename)
+    os.makedirs(folder, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=folder, prefix='.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            fill(f)
+        os.chmod(tmp, _file_mode)
+        os.replace(tmp, filename)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def atomic_write(filename: str, data: bytes) -> None:
+    """
+    Writes data to a temp file next to filename and renames it over
+    filename, so readers never see a half written file.
+    """
+    _atomic_replace(filename, lambda f: f.write(data))
+
+
+def atomic_copy(source: str, filename: str) -> None:
+    def fill(f):
+        with open(source, 'rb') as src:
+            shutil.copyfileobj(src, f, _chunk_size)
+    _atomic_replace(filename, fill)
+
+
+def file_digest(filename: str) -> str:
+    h = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(_chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class _OutputFileMixin:
+    """
+    in-memory file object, handed to the writer once it is closed.
+    nothing is written if the with-block raised.
+    """
+
+    def __init__(self, writer: 'OutputWriter', filename: str):
+        super().__init__()
+        self._writer = writer
+        self.name = filename
+        self._discard = False
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is not None:
+            self._discard = True
+        self.close()
+
+    def close(self):
+        if not self.closed and not self._discard:
+            self._writer.write(self.name, self.getvalue())
+        super().close()
+
+
+class TextOutputFile(_OutputFileMixin, io.StringIO):
+    pass
+
+
+class BinaryOutputFile(_OutputFileMixin, io.BytesIO):
+    pass
+
+
+class OutputWriter:
+    """
+    public attr
+        - minifier              // optional minification stage
+        - compressor            // optional sidecar compression stage
+        - added                 // relative filenames, new in this build
+        - changed               // relative filenames, rewritten in this build
+        - removed               // relative filenames, no longer produced
+
+    public method
+        - begin                 // start tracking a build
+        - open                  // file object, written on close
+        - write                 // write data if it changed
+        - copy                  // copy a file if it changed
+        - keep                  // mark an untouched output as produced
+        - produced              // whether this build produced an output
+        - exists
+        - finish                // write the changed-files manifest
+        - prune                 // delete outputs the last build didn't produce
+    """
+    default_manifest_filename = 'manifest.json'
+    #: whether the outputs and the build caches end up on disk
+    persistent = True
+
+    def __init__(self, builder: 'Builder'):
+        self.builder = builder
+        # {relative filename: [size, mtime_ns, digest(, source digest)]}
+        # of the last build, the source digest is the one before minifying
+        self._state = builder.get_cache('outputs')
+        self.minifier = None
+        self.compressor = None
+        # listing pages are written from a worker pool
+        self._lock = threading.Lock()
+        self._previous = {}
+        self._produced = {}
+        self.added = []
+        self.changed = []
+        self.removed = []
+
+    @property
+    def manifest_filename(self) -> str:
+        return os.path.join(
+            self.builder.project_folder,
+            self.builder.config.root_get('output_manifest') or os.path.join(
+                self.builder.cache_folder, self.default_manifest_filename)
+        )
+
+    def _relname(self, filename: str) -> str:
+        rel = os.path.relpath(filename, self.builder.dest_folder)
+        return rel.replace(os.sep, '/')
+
+    def _is_current(self, filename: str, rel: str, size: int,
+                    digest: str) -> bool:
+        try:
+            st = os.stat(filename)
+        except OSError:
+            return False
+        if st.st_size != size:
+            return False
+        previous = self._previous.get(rel)
+        if previous and previous[:2] == [st.st_size, st.st_mtime_ns]:
+            return previous[2] == digest
+        return file_digest(filename) == digest
+
+    def _is_current_source(self, filename: str, rel: str,
+                           source_digest: str) -> bool:
+        previous = self._previous.get(rel)
+        if not previous or len(previous) < 4 or previous[3] != source_digest:
+            return False
+        try:
+            st = os.stat(filename)
+        except OSError:
+            return False
+        return previous[:2] == [st.st_size, st.st_mtime_ns]
+
+    def _record(self, filename: str, rel: str, digest: str,
+                source_digest: Optional[str] = None) -> None:
+        st = os.stat(filename)
+        entry = [st.st_size, st.st_mtime_ns, digest]
+        if source_digest is not None:
+            entry.append(source_digest)
+        with self._lock:
+            self._produced[rel] = entry
+
+    def _compress(self, filename: str, data: Optional[bytes],
+                  changed: bool) -> None:
+        compressor = self.compressor
+        if compressor is None or not compressor.wants(filename):
+            return
+        if changed or compressor.missing(filename):
+            compressor.submit(filename, data)
+
+    def _commit(self, rel: str, exists: bool) -> str:
+        with self._lock:
+            if exists:
+                self.changed.append(rel)
+                return 'U'
+            self.added.append(rel)
+            return 'A'
+
+    def begin(self) -> None:
+        self._previous = dict(self._state)
+        self._produced = {}
+        self.added = []
+        self.changed = []
+        self.removed = []
+
+    def open(self, filename: str, mode: str = 'w'):
+        if 'r' in mode or 'a' in mode or '+' in mode:
+            raise ValueError(f'output files are write only, got mode {mode}')
+        if 'b' in mode:
+            return BinaryOutputFile(self, filename)
+        return TextOutputFile(self, filename)
+
+    def write(self, filename: str, data: Union[str, bytes]) -> Optional[str]:
+        """
+        Writes data to filename unless the file already holds the same
+        content.  Returns 'A' for a new file, 'U' for an updated one and
+        None if nothing was written.
+        """
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        rel = self._relname(filename)
+        source_digest = None
+        if self.minifier is not None and self.minifier.wants(filename):
+            # unchanged input, the minified output on disk is still good
+            source_digest = hashlib.sha1(data).hexdigest()
+            if self._is_current_source(filename, rel, source_digest):
+                self._produced[rel] = self._previous[rel]
+                self._compress(filename, None, changed=False)
+                return None
+            data = self.minifier.minify(filename, data)
+        digest = hashlib.sha1(data).hexdigest()
+        if self._is_current(filename, rel, len(data), digest):
+            self._record(filename, rel, digest, source_digest)
+            self._compress(filename, data, changed=False)
+            return None
+        exists = os.path.exists(filename)
+        atomic_write(filename, data)
+        self._record(filename, rel, digest, source_digest)
+        self._compress(filename, data, changed=True)
+        return self._commit(rel, exists)
+
+    def copy(self, source: str, filename: str) -> Optional[str]:
+        """
+        Copies source over filename unless both already are identical.
+        """
+        if self.minifier is not None and self.minifier.wants(filename):
+            with open(source, 'rb') as f:
+                return self.write(filename, f.read())
+        rel = self._relname(filename)
+        digest = file_digest(source)
+        if self._is_current(filename, rel, os.path.getsize(source), digest):
+            self._record(filename, rel, digest)
+            self._compress(filename, None, changed=False)
+            return None
+        exists = os.path.exists(filename)
+        atomic_copy(source, filename)
+        self._record(filename, rel, digest)
+        self._compress(filename, None, changed=True)
+        return self._commit(rel, exists)
+
+    def exists(self, filename: str) -> bool:
+        return os.path.exists(filename)
+
+    def produced(self, rel: str) -> bool:
+        """`rel` is relative to the output folder"""
+        return rel in self._produced
+
+    def keep(self, filename: str) -> bool:
+        """
+        Marks an output that was not rebuilt as still produced by this build.
+        Returns False if the file does not exist.
+        """
+        rel = self._relname(filename)
+        if rel in self._produced:
+            return True
+        previous = self._previous.get(rel)
+        try:
+            st = os.stat(filename)
+        except OSError:
+            return False
+        if previous and previous[:2] == [st.st_size, st.st_mtime_ns]:
+            self._produced[rel] = previous
+        else:
+            self._record(filename, rel, file_digest(filename))
+        self._compress(filename, None, changed=False)
+        return True
+
+    def _is_sidecar(self, rel: str) -> bool:
+        if self.compressor is None:
+            return False
+        base, ext = os.path.splitext(rel)
+        return ext in self.compressor.suffixes and base in self._state
+
+    def finish(self) -> None:
+        if self.compressor is not None:
+            self.compressor.wait()
+        self.removed = sorted(set(self._previous) - set(self._produced))
+        self._state.clear()
+        self._state.update(self._produced)
+        manifest = {
+            'added': sorted(self.added),
+            'changed': sorted(self.changed),
+            'removed': self.removed,
+        }
+        atomic_write(self.manifest_filename,
+                     json.dumps(manifest, indent=2).encode('utf-8'))
+
+    def prune(self) -> List[str]:
+        """
+        Deletes every file in the output folder that was not produced by
+        the last finished build and returns their relative filenames.
+        """
+        if not self._state:
+            # nothing recorded yet, everything would look stale
+            return []
+        dest_folder = self.builder.dest_folder
+        manifest = os.path.abspath(self.manifest_filename)
+        removed = []
+        for dirpath, dirnames, filenames in os.walk(dest_folder,
+                                                    topdown=False):
+            for filename in filenames:
+                full = os.path.join(dirpath, filename)
+                rel = self._relname(full)
+                if (rel in self._state or self._is_sidecar(rel)
+                        or full == manifest):
+                    continue
+                os.unlink(full)
+                removed.append(rel)
+            if dirpath != dest_folder and not os.listdir(dirpath):
+                os.rmdir(dirpath)
+        return sorted(removed)
+
+
+class MemoryOutputWriter(OutputWriter):
+    """
+    Keeps the outputs in memory for the dev server.  Written files are
+    kept as bytes, copied files as the path of their source, so large
+    assets are served from where they are.  Nothing is compressed and
+    no manifest is written; `flush` writes everything to disk.
+
+    public attr
+        - files                 // {relative filename: bytes}
+        - links                 // {relative filename: source filename}
+    public method
+        - lookup                // bytes, a source filename or None
+        - flush                 // write the outputs to the output folder
+    """
+    persistent = False
+
+    def __init__(self, builder: 'Builder'):
+        super().__init__(builder)
+        # the disk state belongs to the filesystem builds
+        self._state = {}
+        self.files: Dict[str, bytes] = {}
+        self.links: Dict[str, str] = {}
+
+    def _stat_source(self, source: str) -> list:
+        st = os.stat(source)
+        return [st.st_size, st.st_mtime_ns, source]
+
+    def write(self, filename: str, data: Union[str, bytes]) -> Optional[str]:
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        if self.minifier is not None and self.minifier.wants(filename):
+            data = self.minifier.minify(filename, data)
+        rel = self._relname(filename)
+        self._produced[rel] = [len(data)]
+        if self.files.get(rel) == data:
+            return None
+        exists = self.exists(filename)
+        self.links.pop(rel, None)
+        self.files[rel] = data
+        return self._commit(rel, exists)
+
+    def copy(self, source: str, filename: str) -> Optional[str]:
+        if self.minifier is not None and self.minifier.wants(filename):
+            with open(source, 'rb') as f:
+                return self.write(filename, f.read())
+        rel = self._relname(filename)
+        entry = self._stat_source(source)
+        previous = self._previous.get(rel)
+        self._produced[rel] = entry
+        if rel in self.links and previous == entry:
+            return None
+        exists = self.exists(filename)
+        self.files.pop(rel, None)
+        self.links[rel] = source
+        return self._commit(rel, exists)
+
+    def exists(self, filename: str) -> bool:
+        rel = self._relname(filename)
+        return rel in self.files or rel in self.links
+
+    def keep(self, filename: str) -> bool:
+        rel = self._relname(filename)
+        if rel in self._produced:
+            return True
+        if rel in self.files:
+            self._produced[rel] = [len(self.files[rel])]
+        elif rel in self.links and os.path.exists(self.links[rel]):
+            self._produced[rel] = self._stat_source(self.links[rel])
+        else:
+            return False
+        return True
+
+    def lookup(self, rel: str) -> Union[bytes, str, None]:
+        rv = self.files.get(rel)
+        if rv is None:
+            rv = self.links.get(rel)
+        return rv
+
+    def finish(self) -> None:
+        self.removed = sorted(set(self._previous) - set(self._produced))
+        for rel in self.removed:
+            self.files.pop(rel, None)
+            self.links.pop(rel, None)
+        self._state.clear()
+        self._state.update(self._produced)
+
+    def prune(self) -> List[str]:
+        # outputs that are not produced any more are dropped by finish
+        return []
+
+    def flush(self, writer: OutputWriter) -> None:
+        """Writes every output through a filesystem writer"""
+        dest_folder = self.builder.dest_folder
+        writer.begin()
+        for rel, data in self.files.items():
+            writer.write(os.path.join(dest_folder, rel), data)
+        for rel, source in self.links.items():
+            writer.copy(source, os.path.join(dest_folder, rel))
+        writer.finish()
+
+
+class ArchiveOutputWriter(OutputWriter):
+    """
+    Streams the outputs of one build into a tar or zip archive, in a
+    single sequential pass and without an output folder.  The format is
+    picked by the extension of `target` (.tar, .tar.gz, .tgz, .tar.bz2,
+    .tar.xz or .zip).  The archive replaces `target` once the build
+    finished.  Every output is rendered, nothing is compressed and no
+    manifest or build cache is written.
+
+    public attr
+        - target
+    """
+    persistent = False
+
+    tar_modes = (('.tar.gz', 'w|gz'), ('.tgz', 'w|gz'),
+                 ('.tar.bz2', 'w|bz2'), ('.tar.xz', 'w|xz'), ('.tar', 'w|'))
+
+    def __init__(self, builder: 'Builder', target: str):
+        super().__init__(builder)
+        self._state = {}
+        self.target = os.path.abspath(target)
+        self._archive = None
+        # tar and zip streams take one member at a time
+        self._archive_lock = threading.Lock()
+        self._tmp = None
+        self._mtime = 0
+        self._written: Dict[str, str] = {}
+
+    def _open_archive(self):
+        folder = os.path.dirname(self.target)
+        os.makedirs(folder, exist_ok=True)
+        fd, self._tmp = tempfile.mkstemp(dir=folder, prefix='.',
+                                         suffix='.tmp')
+        os.close(fd)
+        if self.target.endswith('.zip'):
+            return zipfile.ZipFile(self._tmp, 'w', zipfile.ZIP_DEFLATED)
+        for suffix, mode in self.tar_modes:
+            if self.target.endswith(suffix):
+                return tarfile.open(self._tmp, mode)
+        os.unlink(self._tmp)
+        raise ValueError(f'unknown archive format of {self.target}')
+
+    def begin(self) -> None:
+        super().begin()
+        self._close(discard=True)
+        self._written = {}
+        self._mtime = int(time.time())
+        self._archive = self._open_archive()
+
+    def _add(self, rel: str, digest: str, data: Optional[bytes] = None,
+             source: Optional[str] = None) -> Optional[str]:
+        with self._archive_lock:
+            return self._add_member(rel, digest, data, source)
+
+    def _add_member(self, rel: str, digest: str, data: Optional[bytes],
+                    source: Optional[str]) -> Optional[str]:
+        previous = self._written.get(rel)
+        if previous == digest:
+            return None
+        if isinstance(self._archive, zipfile.ZipFile):
+            info = zipfile.ZipInfo(rel, time.localtime(self._mtime)[:6])
+            info.compress_type = zipfile.ZIP_DEFLATED
+            info.external_attr = (_file_mode & 0o777) << 16
+            if data is None:
+                with open(source, 'rb') as src, \
+                        self._archive.open(info, 'w') as f:
+                    shutil.copyfileobj(src, f, _chunk_size)
+            else:
+                self._archive.writestr(info, data)
+        else:
+            info = tarfile.TarInfo(rel)
+            info.mtime = self._mtime
+            info.mode = _file_mode
+            if data is None:
+                info.size = os.path.getsize(source)
+                with open(source, 'rb') as src:
+                    self._archive.addfile(info, src)
+            else:
+                info.size = len(data)
+                self._archive.addfile(info, io.BytesIO(data))
+        self._written[rel] = digest
+        self._produced[rel] = [digest]
+        # a rewritten member is appended again, the last one wins
+        return self._commit(rel, previous is not None)
+
+    def write(self, filename: str, data: Union[str, bytes]) -> Optional[str]:
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        if self.minifier is not None and self.minifier.wants(filename):
+            data = self.minifier.minify(filename, data)
+        return self._add(self._relname(filename),
+                         hashlib.sha1(data).hexdigest(), data=data)
+
+    def copy(self, source: str, filename: str) -> Optional[str]:
+        if self.minifier is not None and self.minifier.wants(filename):
+            with open(source, 'rb') as f:
+                return self.write(filename, f.read())
+        return self._add(self._relname(filename), file_digest(source),
+                         source=source)
+
+    def exists(self, filename: str) -> bool:
+        return self._relname(filename) in self._written
+
+    def keep(self, filename: str) -> bool:
+        # an output is only in the archive if it was written this build
+        return self.exists(filename)
+
+    def _close(self, discard: bool = False) -> None:
+        with self._archive_lock:
+            if self._archive is None:
+                return
+            self._archive.close()
+            self._archive = None
+        if discard:
+            os.unlink(self._tmp)
+        else:
+            os.chmod(self._tmp, _file_mode)
+            os.replace(self._tmp, self.target)
+
+    def finish(self) -> None:
+        self._close()
+
+    def prune(self) -> List[str]:
+        return []
+
+
+#: output writers by backend name, see `Builder.set_output`
+output_backends = {
+    'filesystem': OutputWriter,
+    'memory': MemoryOutputWriter,
+    'archive': ArchiveOutputWriter,
+}
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+fast url building on top of a werkzeug url map
+"""
+
+import re
+from typing import Dict, List, Optional, Tuple
+
+from werkzeug.routing import Map, Rule, MapAdapter
+
+
+_rule_re = re.compile(r'''
+    <
+    (?:
+        (?P<converter>[a-zA-Z_][a-zA-Z0-9_]*)
+        (?:\((?P<args>.*?)\))?
+        :
+    )?
+    (?P<variable>[a-zA-Z_][a-zA-Z0-9_]*)
+    >
+''', re.X)
+
+
+class CompiledRule:
+    """
+    A rule turned into a list of static strings and converters.  It is
+    None if the rule uses anything this does not reproduce (converter
+    arguments, hosts, subdomains), werkzeug builds those.
+    """
+
+    def __init__(self, url_map: Map, rule: Rule):
+        self.rule = rule
+        self.parts = self._compile(url_map, rule)
+
+    @staticmethod
+    def _compile(url_map: Map, rule: Rule) -> Optional[list]:
+        if rule.subdomain or getattr(rule, 'host', None):
+            return None
+        parts = []
+        pos = 0
+        for match in _rule_re.finditer(rule.rule):
+            if match.group('args') is not None:
+                return None
+            converter = url_map.converters.get(
+                match.group('converter') or 'default')
+            if converter is None:
+                return None
+            parts.append(rule.rule[pos:match.start()])
+            parts.append((match.group('variable'), converter(url_map)))
+            pos = match.end()
+        parts.append(rule.rule[pos:])
+        return parts
+
+    def format(self, script_name: str, values: dict) -> str:
+        rv = []
+        for part in self.parts:
+            if isinstance(part, str):
+                rv.append(part)
+            else:
+                name, converter = part
+                rv.append(converter.to_url(values[name]))
+        path = ''.join(rv)
+        return f"{script_name.rstrip('/')}/{path.lstrip('/')}"
+
+
+class RouteCache:
+    """
+    Builds the same urls as `MapAdapter.build`, from compiled rules and
+    with every (endpoint, values) result memoized.  Each compiled rule
+    is checked against werkzeug the first time it is used and given up
+    on if the results differ.
+
+    public method
+        - add                   // register a rule
+        - build                 // build a url
+    """
+
+    def __init__(self, url_map: Map, adapter: MapAdapter):
+        self._map = url_map
+        self._adapter = adapter
+        self._rules: Dict[str, List[CompiledRule]] = {}
+        self._verified = set()
+        self._memo: Dict[Tuple, str] = {}
+
+    def add(self, rule: Rule) -> None:
+        rules = self._rules.setdefault(rule.endpoint, [])
+        rules.append(CompiledRule(self._map, rule))
+        # the order werkzeug tries rules of an endpoint in
+        rules.sort(key=lambda x: x.rule.build_compare_key())
+        self._memo.clear()
+
+    def _build(self, endpoint: str, values: dict) -> str:
+        for compiled in self._rules.get(endpoint, ()):
+            if not compiled.rule.suitable_for(values):
+                continue
+            if (compiled.parts is None or None in values.values()
+                    or not compiled.rule.arguments.issuperset(values)):
+                break
+            rv = compiled.format(self._adapter.script_name, values)
+            key = (id(compiled), tuple(sorted(values)))
+            if key not in self._verified:
+                if rv != self._adapter.build(endpoint, values):
+                    compiled.parts = None
+                    break
+                self._verified.add(key)
+            return rv
+        return self._adapter.build(endpoint, values)
+
+    def build(self, endpoint: str, values: dict) -> str:
+        try:
+            key = (endpoint, tuple(sorted(values.items())))
+            hash(key)
+        except TypeError:
+            return self._adapter.build(endpoint, values)
+        rv = self._memo.get(key)
+        if rv is None:
+            rv = self._memo[key] = self._build(endpoint, values)
+        return rv
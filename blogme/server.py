@@ -1,21 +1,302 @@
 # -*- coding: utf-8 -*-
 
 import os
+import re
+import posixpath
+import json
+import queue
+import threading
+import traceback
+from io import BytesIO
+from http import HTTPStatus
 from http.server import HTTPServer
 from http.server import SimpleHTTPRequestHandler
+from socketserver import ThreadingMixIn
 from urllib.parse import unquote
+from typing import List
 
 from blogme.builder import Builder
+from blogme.lazy import LazyRenderer
+
+
+sidecar_encodings = {'.br': 'br', '.gz': 'gzip'}
+
+#: server-sent events of the live reload, below the prefix path
+events_path = '/__blogme__/events'
+
+#: reloads the page if it, a stylesheet or a script changed
+live_reload_script = '''<script>
+(function () {
+  var source = new EventSource(%s);
+  source.addEventListener('reload', function (e) {
+    // the urls are sent as they are, the path is percent-encoded
+    var here = location.pathname;
+    try { here = decodeURIComponent(here); } catch (err) {}
+    JSON.parse(e.data).some(function (url) {
+      return url === here || /\\.(css|js)$/.test(url);
+    }) && location.reload();
+  });
+})();
+</script>
+'''
+
+_body_end_re = re.compile(rb'</body\s*>', re.I)
+
+
+class LiveReload:
+    """
+    Rebuilds in the background once a source changed, then pushes the
+    urls of the changed outputs to every subscribed browser.
+
+    public method
+        - start                 // start watching in a daemon thread
+        - stop
+        - subscribe             // queue of url lists
+        - unsubscribe
+        - build                 // build now and notify
+    """
+
+    def __init__(self, builder: Builder, interval: float = 0.5,
+                 flush: bool = False, lazy: LazyRenderer = None):
+        self.builder = builder
+        self.interval = interval
+        self.flush = flush
+        self.lazy = lazy
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._stopped = threading.Event()
+
+    def start(self) -> None:
+        thread = threading.Thread(target=self._watch, name='live-reload',
+                                  daemon=True)
+        thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+    def subscribe(self) -> queue.Queue:
+        q = queue.Queue()
+        with self._lock:
+            self._subscribers.add(q)
+        return q
+
+    def unsubscribe(self, q: queue.Queue) -> None:
+        with self._lock:
+            self._subscribers.discard(q)
+
+    def get_urls(self, filenames: List[str]) -> List[str]:
+        prefix = self.builder.prefix_path.rstrip('/')
+        urls = []
+        for filename in filenames:
+            url = f'{prefix}/{filename}'
+            urls.append(url)
+            if filename == 'index.html' or filename.endswith('/index.html'):
+                urls.append(url[:-len('index.html')])
+        return urls
+
+    def build(self) -> None:
+        writer = self.builder.writer
+        try:
+            if self.lazy is not None:
+                # only what was shown is rendered again
+                filenames = self.lazy.refresh()
+            else:
+                self.builder.run()
+                filenames = writer.added + writer.changed + writer.removed
+            if self.flush:
+                self.builder.flush()
+        except Exception:
+            traceback.print_exc()
+            return
+        urls = self.get_urls(filenames)
+        if not urls:
+            return
+        with self._lock:
+            for q in self._subscribers:
+                q.put(urls)
+
+    def _watch(self) -> None:
+        while not self._stopped.is_set():
+            try:
+                if self.lazy is not None:
+                    changed = self.lazy.needs_refresh()
+                else:
+                    changed = self.builder.anything_needs_build()
+                if changed:
+                    print('Detected change, building')
+                    self.build()
+            except Exception:
+                traceback.print_exc()
+            self._stopped.wait(self.interval)
 
 
 class SimpleRequestHandler(SimpleHTTPRequestHandler):
 
     def do_GET(self):
-        if self.server.builder.anything_needs_build():
-            print('Detected change, building')
-            self.server.builder.run()
+        live_reload = self.server.live_reload
+        if live_reload is None:
+            self.server.refresh()
+        elif self._is_events_request():
+            self._send_events(live_reload)
+            return
         SimpleHTTPRequestHandler.do_GET(self)
 
+    def _events_url(self) -> str:
+        return self.server.builder.prefix_path.rstrip('/') + events_path
+
+    def _is_events_request(self) -> bool:
+        return self.path.split('?', 1)[0] == self._events_url()
+
+    def _send_events(self, live_reload: LiveReload):
+        q = live_reload.subscribe()
+        try:
+            self.send_response(HTTPStatus.OK)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Cache-Control', 'no-cache')
+            self.end_headers()
+            while True:
+                try:
+                    urls = q.get(timeout=15)
+                except queue.Empty:
+                    # keeps proxies from closing an idle connection
+                    self.wfile.write(b': ping\n\n')
+                else:
+                    data = json.dumps(urls)
+                    self.wfile.write(f'event: reload\ndata: {data}\n\n'
+                                     .encode('utf-8'))
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            live_reload.unsubscribe(q)
+
+    def _send_page(self, path):
+        with open(path, 'rb') as f:
+            return self._send_html(f.read())
+
+    def _send_html(self, data: bytes):
+        """Sends an html page with the live reload client injected"""
+        if self.server.live_reload is not None:
+            script = (live_reload_script %
+                      json.dumps(self._events_url())).encode('utf-8')
+            matches = list(_body_end_re.finditer(data))
+            pos = matches[-1].start() if matches else len(data)
+            data = data[:pos] + script + data[pos:]
+        self.send_response(HTTPStatus.OK)
+        self.send_header('Content-type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        return BytesIO(data)
+
+    def _find_page(self, path):
+        if self.server.live_reload is None:
+            return None
+        if os.path.isdir(path):
+            if not self.path.split('?', 1)[0].endswith('/'):
+                return None
+            path = os.path.join(path, 'index.html')
+        if path.endswith('.html') and os.path.isfile(path):
+            return path
+        return None
+
+    def _accepted_encodings(self):
+        accepted = set()
+        for item in self.headers.get('Accept-Encoding', '').split(','):
+            name, _, params = item.strip().partition(';')
+            if params.strip().replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00'):
+                continue
+            accepted.add(name.strip().lower())
+        return accepted
+
+    def _find_sidecar(self, path):
+        compressor = self.server.builder.writer.compressor
+        if compressor is None:
+            return None
+        if os.path.isdir(path):
+            if not self.path.split('?', 1)[0].endswith('/'):
+                return None
+            path = os.path.join(path, 'index.html')
+        accepted = self._accepted_encodings()
+        for suffix in ('.br', '.gz'):
+            encoding = sidecar_encodings[suffix]
+            if (suffix in compressor.suffixes and encoding in accepted
+                    and os.path.isfile(path + suffix)):
+                return path, path + suffix, encoding
+        return None
+
+    def _lookup(self, rel):
+        lazy = self.server.lazy
+        if lazy is not None and not lazy.render(rel):
+            return None
+        return self.server.builder.writer.lookup(rel)
+
+    def _send_from_memory(self, path):
+        """Serves the outputs of an in-memory build"""
+        writer = self.server.builder.writer
+        url = self.path.split('?', 1)[0].split('#', 1)[0]
+        rel = writer._relname(path)
+        if rel == '.':
+            rel = ''
+        if url.endswith('/'):
+            rel = posixpath.join(rel, 'index.html')
+        found = self._lookup(rel) if rel else None
+        if found is None and not url.endswith('/') and self._lookup(
+                posixpath.join(rel, 'index.html')) is not None:
+            self.send_response(HTTPStatus.MOVED_PERMANENTLY)
+            self.send_header('Location', url + '/')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return None
+        if found is None:
+            self.send_error(HTTPStatus.NOT_FOUND, 'File not found')
+            return None
+        if rel.endswith('.html'):
+            if isinstance(found, str):
+                with open(found, 'rb') as f:
+                    found = f.read()
+            return self._send_html(found)
+        if isinstance(found, str):
+            # copied files are served from their source
+            f = open(found, 'rb')
+            size = os.fstat(f.fileno()).st_size
+        else:
+            f = BytesIO(found)
+            size = len(found)
+        self.send_response(HTTPStatus.OK)
+        self.send_header('Content-type', self.guess_type(rel))
+        self.send_header('Content-Length', str(size))
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        return f
+
+    def send_head(self):
+        path = self.translate_path(self.path)
+        if not self.server.builder.writer.persistent:
+            return self._send_from_memory(path)
+        page = self._find_page(path)
+        if page is not None:
+            return self._send_page(page)
+        sidecar = self._find_sidecar(path)
+        if sidecar is None:
+            return SimpleHTTPRequestHandler.send_head(self)
+        path, sidecar_path, encoding = sidecar
+        f = open(sidecar_path, 'rb')
+        try:
+            fs = os.fstat(f.fileno())
+            self.send_response(HTTPStatus.OK)
+            self.send_header('Content-type', self.guess_type(path))
+            self.send_header('Content-Encoding', encoding)
+            self.send_header('Content-Length', str(fs.st_size))
+            self.send_header('Last-Modified',
+                             self.date_time_string(fs.st_mtime))
+            self.send_header('Vary', 'Accept-Encoding')
+            self.end_headers()
+            return f
+        except Exception:
+            f.close()
+            raise
+
     def translate_path(self, path: str) -> str:
         print('get', path)
         path = path.split('?', 1)[0].split('#', 1)[0]
@@ -43,8 +324,40 @@ class SimpleRequestHandler(SimpleHTTPRequestHandler):
         pass
 
 
-class Server(HTTPServer):
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
 
-    def __init__(self, host: str, port: int, builder: Builder):
-        super().__init__((host, int(port)), SimpleRequestHandler)
+    def __init__(self, host: str, port: int, builder: Builder,
+                 live_reload: bool = True, flush: bool = False,
+                 lazy: bool = False):
+        # server_close is called if binding the port fails
         self.builder = builder
+        self.lazy = None
+        self.live_reload = None
+        self._build_lock = threading.Lock()
+        super().__init__((host, int(port)), SimpleRequestHandler)
+        if lazy:
+            self.lazy = LazyRenderer(builder)
+        if live_reload:
+            self.live_reload = LiveReload(
+                builder, builder.config.root_get('live_reload_interval', 0.5),
+                flush, self.lazy)
+            self.live_reload.start()
+
+    def refresh(self) -> None:
+        """
+        Builds, or prepares the lazy renderer, if a source changed.  One
+        build at a time: requests that waited for it find nothing to do.
+        """
+        with self._build_lock:
+            if self.lazy is not None:
+                if self.lazy.needs_refresh():
+                    self.lazy.prepare()
+            elif self.builder.anything_needs_build():
+                print('Detected change, building')
+                self.builder.run()
+
+    def server_close(self):
+        if self.live_reload is not None:
+            self.live_reload.stop()
+        super().server_close()
@@ -1,9 +1,195 @@
 # -*- coding: utf-8 -*-
 
-from blinker import Namespace
+import time
+import threading
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
 
+from blinker import Namespace, NamedSignal
 
-signals = Namespace()
+
+class HookStats:
+    """
+    Cost of one receiver of one signal.  `total` includes the receivers
+    of signals it sent itself, `own` does not; `allocated` is the net
+    number of bytes it allocated (only if allocations are tracked).
+    """
+
+    def __init__(self, signal: str, receiver: str, module: str):
+        self.signal = signal
+        self.receiver = receiver
+        self.module = module
+        self.calls = 0
+        self.total = 0.0
+        self.own = 0.0
+        self.allocated = 0
+
+    def to_dict(self) -> dict:
+        return {
+            'signal':       self.signal,
+            'receiver':     self.receiver,
+            'module':       self.module,
+            'calls':        self.calls,
+            'total':        self.total,
+            'own':          self.own,
+            'allocated':    self.allocated,
+        }
+
+
+class HookProfiler:
+    """
+    Records the calls of signal receivers while it is active, see
+    `profile_hooks`.
+
+    public attr
+        - stats                 // {(signal, receiver): HookStats}
+        - allocations           // whether allocations are tracked
+    public method
+        - start
+        - stop
+        - reset
+        - get_stats             // filtered by module or signal, slowest first
+        - report                // a printable table
+        - to_dict
+    """
+
+    def __init__(self, allocations: bool = False):
+        self.allocations = allocations
+        self.stats: Dict[Tuple[str, str], HookStats] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._started_tracemalloc = False
+
+    def start(self) -> None:
+        global _profiler
+        if self.allocations:
+            import tracemalloc
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracemalloc = True
+        _profiler = self
+
+    def stop(self) -> None:
+        global _profiler
+        if _profiler is self:
+            _profiler = None
+        if self._started_tracemalloc:
+            import tracemalloc
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+    def reset(self) -> None:
+        with self._lock:
+            self.stats.clear()
+
+    def _get_stats(self, signal: str, receiver) -> HookStats:
+        module = getattr(receiver, '__module__', None) or '?'
+        name = getattr(receiver, '__qualname__', None) or repr(receiver)
+        key = (signal, f'{module}.{name}')
+        rv = self.stats.get(key)
+        if rv is None:
+            rv = self.stats.setdefault(key, HookStats(signal, key[1], module))
+        return rv
+
+    def call(self, signal: str, receiver, sender, kwargs):
+        # time spent in nested receivers, per running receiver
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        if self.allocations:
+            import tracemalloc
+            memory_before = tracemalloc.get_traced_memory()[0]
+        stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            return receiver(sender, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            nested = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            allocated = 0
+            if self.allocations:
+                allocated = tracemalloc.get_traced_memory()[0] - memory_before
+            with self._lock:
+                stats = self._get_stats(signal, receiver)
+                stats.calls += 1
+                stats.total += elapsed
+                stats.own += elapsed - nested
+                stats.allocated += allocated
+
+    def get_stats(self, module: Optional[str] = None,
+                  signal: Optional[str] = None) -> list:
+        with self._lock:
+            rv = [x for x in self.stats.values()
+                  if (module is None or x.module == module
+                      or x.module.endswith('.' + module))
+                  and (signal is None or x.signal == signal)]
+        return sorted(rv, key=lambda x: -x.total)
+
+    def report(self, limit: Optional[int] = None) -> str:
+        lines = [f'{"calls":>7} {"total ms":>10} {"own ms":>10} '
+                 f'{"alloc kb":>9}  signal / receiver']
+        for x in self.get_stats()[:limit]:
+            alloc = f'{x.allocated / 1024:9.1f}' if self.allocations \
+                else f'{"-":>9}'
+            lines.append(f'{x.calls:7d} {x.total * 1000:10.2f} '
+                         f'{x.own * 1000:10.2f} {alloc}  '
+                         f'{x.signal} / {x.receiver}')
+        return '\n'.join(lines)
+
+    def to_dict(self) -> dict:
+        return {'allocations': self.allocations,
+                'hooks': [x.to_dict() for x in self.get_stats()]}
+
+
+_profiler: Optional[HookProfiler] = None
+
+
+@contextmanager
+def profile_hooks(allocations: bool = False):
+    """
+    Profiles every signal receiver called in the with-block:
+
+        with profile_hooks() as profiler:
+            builder.run()
+        print(profiler.report())
+    """
+    profiler = HookProfiler(allocations)
+    profiler.start()
+    try:
+        yield profiler
+    finally:
+        profiler.stop()
+
+
+class ProfiledSignal(NamedSignal):
+    """A signal whose receivers are timed while a profiler is active"""
+
+    def send(self, *sender, **kwargs):
+        profiler = _profiler
+        if profiler is None:
+            return super().send(*sender, **kwargs)
+        if len(sender) > 1:
+            raise TypeError(f'send() accepts only one positional argument, '
+                            f'{len(sender)} given')
+        sender = sender[0] if sender else None
+        if getattr(self, 'is_muted', False):
+            return []
+        return [(receiver, profiler.call(self.name, receiver, sender, kwargs))
+                for receiver in self.receivers_for(sender)]
+
+
+class _Namespace(Namespace):
+
+    def signal(self, name, doc=None):
+        try:
+            return self[name]
+        except KeyError:
+            return self.setdefault(name, ProfiledSignal(name, doc))
+
+
+signals = _Namespace()
 
 before_build = signals.signal('before_build')
 
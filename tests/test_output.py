@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+import os
+import tarfile
+import zipfile
+
+import pytest
+
+from blogme.cli import get_builder
+
+
+def make_project(folder, workers):
+    os.makedirs(folder)
+    with open(os.path.join(folder, 'config.yml'), 'w') as f:
+        f.write('title: Test\n'
+                'active_modules: [blog, tags]\n'
+                f'listing_workers: {workers}\n')
+    for i in range(1, 31):
+        post = os.path.join(folder, '2021', '03', f'{i:02d}')
+        os.makedirs(post)
+        with open(os.path.join(post, f'p{i}.md'), 'w') as f:
+            f.write(f'title: Post {i}\n'
+                    f'tags: [t{i % 10}, t{i % 3}]\n\n'
+                    f'body {i}\n')
+    return folder
+
+
+def read_archive(filename):
+    if filename.endswith('.zip'):
+        with zipfile.ZipFile(filename) as f:
+            assert f.testzip() is None
+            return {x: f.read(x) for x in f.namelist()}
+    rv = {}
+    with tarfile.open(filename) as f:
+        for member in f:
+            rv[member.name] = f.extractfile(member).read()
+    return rv
+
+
+def build_archive(folder, target):
+    builder = get_builder(folder)
+    builder.set_output('archive', target)
+    builder.run()
+    return read_archive(target)
+
+
+@pytest.mark.parametrize('suffix', ['.tar.gz', '.tar', '.zip'])
+def test_archive_written_by_listing_workers(tmp_path, suffix):
+    serial = make_project(str(tmp_path / 'serial'), 1)
+    parallel = make_project(str(tmp_path / 'parallel'), 8)
+
+    expected = build_archive(serial, str(tmp_path / f'serial{suffix}'))
+    for _ in range(3):
+        files = build_archive(parallel, str(tmp_path / f'parallel{suffix}'))
+        assert files == expected
+        # members are added in the same order, whatever the workers do
+        assert list(files) == list(expected)
+
+    assert 'tags/t0/index.html' in files
+    assert 'index.html' in files